@@ -0,0 +1,46 @@
+'''
+Organization name analysis profiles.
+
+A profile defines how the organization name is indexed and searched:
+
+- `ngram`: every 3 characters gram of every word (the historical analysis)
+- `edgengram`: accent-folded word prefixes from 2 to 15 characters
+- `words`: accent-folded French stemmed words plus a prefix index of their first 3 to 10 characters
+'''
+from collections import OrderedDict
+
+from whoosh import fields
+from whoosh.analysis import (
+    CharsetFilter, LanguageAnalyzer, LowercaseFilter, NgramFilter, NgramWordAnalyzer, RegexTokenizer
+)
+from whoosh.support.charset import accent_map
+
+DEFAULT_PROFILE = 'ngram'
+NAME_FIELD = 'da_raison_sociale'
+PREFIX_FIELD = 'da_raison_sociale_prefix'
+
+
+def edge_ngrams(minsize, maxsize):
+    '''Accent-folded word prefixes'''
+    return RegexTokenizer() | LowercaseFilter() | CharsetFilter(accent_map) | NgramFilter(minsize, maxsize, at='start')
+
+
+PROFILES = OrderedDict((
+    ('ngram', {
+        NAME_FIELD: lambda: fields.TEXT(stored=True, analyzer=NgramWordAnalyzer(minsize=3), phrase=False),
+    }),
+    ('edgengram', {
+        NAME_FIELD: lambda: fields.TEXT(stored=True, analyzer=edge_ngrams(2, 15), phrase=False),
+    }),
+    ('words', {
+        NAME_FIELD: lambda: fields.TEXT(stored=True, analyzer=LanguageAnalyzer('fr') | CharsetFilter(accent_map)),
+        PREFIX_FIELD: lambda: fields.TEXT(analyzer=edge_ngrams(3, 10), phrase=False),
+    }),
+))
+
+
+def name_fields(profile=DEFAULT_PROFILE):
+    '''The organization name fields of a profile by name'''
+    if profile not in PROFILES:
+        raise ValueError('Unknown analyzer profile: {0}'.format(profile))
+    return OrderedDict((name, factory()) for name, factory in PROFILES[profile].items())
@@ -1,5 +1,14 @@
-from flask import current_app
-from flask_restplus import Api, Resource, cors, fields
+import json
+import threading
+
+from functools import wraps
+
+from flask import Response, current_app, request
+from flask_restplus import Api, Resource, cors, fields, inputs, marshal
+
+from . import export, responses, serializer
+from .database import COUNTS
+from .metrics import PROMETHEUS_MIMETYPE
 
 api = Api(
     title='OFSearch API',
@@ -9,10 +18,33 @@ api = Api(
 )
 
 
+DEFAULT_MAX_BATCH = 1000
+BATCH_CHUNK_SIZE = 100
+DEFAULT_MAX_CONCURRENT = 32
+RETRY_AFTER = 1  # in seconds
+NDJSON_MIMETYPE = 'application/x-ndjson'
+FACETS = ('specialty', 'department')
+SORTS = ('form_total', 'trainees', 'hours')
+
 parser = api.parser()
-parser.add_argument('q', type=str, help='The search query', required=True)
+parser.add_argument('q', type=str, help='The search query', default='')
 parser.add_argument('page', type=int, help='Page to display', default=1)
 parser.add_argument('limit', type=int, help='Max number of results per page', default=20)
+parser.add_argument('specialty', type=int, action='append',
+                    help='Only organizations training in this specialty code (repeatable)')
+parser.add_argument('facets', type=str, action='append', choices=FACETS,
+                    help='Facets to count matching organizations for (repeatable)')
+parser.add_argument('sort', type=str, choices=SORTS,
+                    help='Sort by decreasing number of trainers, trainees or hours instead of relevance')
+parser.add_argument('min_trainers', type=int, help='Only organizations with at least this number of trainers')
+parser.add_argument('min_hours', type=int, help='Only organizations with at least this number of training hours')
+parser.add_argument('postal_code', type=str, help='Only organizations with a postal code starting with this prefix')
+parser.add_argument('department', type=str, help='Only organizations located in this department code (ie. 2A or 974)')
+parser.add_argument('fuzzy', type=inputs.boolean, default=False,
+                    help='Correct misspelled organization name words before searching')
+parser.add_argument('cursor', type=str, help='Continue after the last result of a previous page (its `next_cursor`)')
+parser.add_argument('count', type=str, choices=COUNTS, default='exact',
+                    help='Wether the total is exact, estimated or capped for relevance sorted results')
 
 specialty = api.model('Specialty', {
     'code': fields.Integer,
@@ -37,14 +69,101 @@ organization = api.model('Organization', {
     'specialties': fields.List(fields.Nested(specialty))
 })
 
+facet = api.model('Facet', {
+    'value': fields.String,
+    'label': fields.String,
+    'count': fields.Integer,
+})
+
+facets = api.model('Facets', {
+    'specialty': fields.List(fields.Nested(facet)),
+    'department': fields.List(fields.Nested(facet)),
+})
+
 search_results = api.model('SearchResult', {
     'query': fields.String,
+    'corrected': fields.String(description='The searched query with corrected spelling in fuzzy mode'),
     'page': fields.Integer,
     'limit': fields.Integer,
     'total': fields.Integer,
+    'count': fields.String(description='How the total has been computed', enum=COUNTS),
     'results': fields.List(fields.Nested(organization)),
+    'next_cursor': fields.String(description='The cursor to the next page if any'),
+    'partial': fields.Boolean(description='Whether the search has been stopped by the time limit'),
+    'facets': fields.Nested(facets, allow_null=True),
+})
+
+
+suggest_parser = api.parser()
+suggest_parser.add_argument('prefix', type=str, help='The organization name prefix', required=True)
+suggest_parser.add_argument('limit', type=int, help='Max number of suggestions', default=10)
+
+suggestion = api.model('Suggestion', {
+    'id': fields.String(description='The declaration number'),
+    'name': fields.String,
 })
 
+export_parser = api.parser()
+export_parser.add_argument('format', type=str, choices=export.FORMATS, default='ndjson', help='The export format')
+export_parser.add_argument('q', type=str, help='An optional search query')
+export_parser.add_argument('postal_code', type=str, help='An optional postal code prefix')
+export_parser.add_argument('department', type=str, help='An optional department code')
+
+batch_request = api.model('BatchRequest', {
+    'ids': fields.List(fields.String, required=True, description='SIRENs, SIRETs or declaration numbers'),
+})
+
+batch_item = api.model('BatchItem', {
+    'id': fields.String,
+    'found': fields.Boolean,
+    'organization': fields.Nested(organization, allow_null=True),
+})
+
+batch_results = api.model('BatchResult', {
+    'results': fields.List(fields.Nested(batch_item)),
+})
+
+
+def cache_key(args):
+    '''A hashable cache key from parsed arguments'''
+    return tuple((k, tuple(v) if isinstance(v, list) else v) for k, v in sorted(args.items()))
+
+
+def json_response(body, etag=None):
+    '''A response from an already serialized JSON body'''
+    response = Response(body + b'\n', mimetype='application/json')
+    if etag:
+        response.set_etag(etag)
+    return response
+
+
+class Limiter(object):
+    '''Count the requests being processed, up to `size` (unlimited if 0)'''
+    def __init__(self, size=DEFAULT_MAX_CONCURRENT):
+        self._semaphore = threading.BoundedSemaphore(size) if size else None
+
+    def acquire(self):
+        return self._semaphore is None or self._semaphore.acquire(blocking=False)
+
+    def release(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+
+def limited(func):
+    '''Reject requests with a 503 instead of queueing them once the worker is saturated'''
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        limiter = current_app.extensions['limiter']
+        if not limiter.acquire():
+            current_app.extensions['db'].metrics.rejected += 1
+            return {'message': 'Too many requests in progress, retry later'}, 503, {'Retry-After': str(RETRY_AFTER)}
+        try:
+            return func(*args, **kwargs)
+        finally:
+            limiter.release()
+    return wrapper
+
 
 class WithDb(object):
     @property
@@ -56,24 +175,148 @@ class WithDb(object):
 @api.expect(parser)
 class Search(WithDb, Resource):
     @api.doc('search')
-    @api.marshal_with(search_results)
+    @api.response(200, 'Success', search_results)
+    @api.response(400, 'Malformed or expired cursor')
+    @api.response(503, 'Too many requests in progress')
+    @limited
     def get(self):
         '''Search organizations on their name, SIREN or declaration number'''
         args = parser.parse_args()
-        return self.db.search(args['q'], page=args['page'], limit=args['limit'])
+        metrics = self.db.metrics
+        with metrics.trace('search', **args):
+            key = cache_key(args)
+            tag = self.db.tag
+            etag = responses.make_etag(tag, key)
+            response = responses.not_modified(etag)
+            if response is not None:
+                return response
+            result = self.db.pages.get(key, tag)
+            if result is None:
+                try:
+                    result = self.db.search(
+                        args['q'],
+                        page=args['page'],
+                        limit=args['limit'],
+                        specialties=args['specialty'],
+                        facets=args['facets'],
+                        sort=args['sort'],
+                        min_trainers=args['min_trainers'],
+                        min_hours=args['min_hours'],
+                        postal_code=args['postal_code'],
+                        department=args['department'],
+                        fuzzy=args['fuzzy'],
+                        cursor=args['cursor'],
+                        count=args['count'],
+                        raw=True,
+                    )
+                except ValueError as e:
+                    api.abort(400, str(e))
+                partial = result['partial']
+                with metrics.stage('marshal'):
+                    documents = result.pop('results')
+                    result = serializer.splice(marshal(result, search_results), 'results', documents)
+                if partial:
+                    # Results cut by the time limit should not outlive the load that caused them
+                    response = json_response(result)
+                    response.headers['Cache-Control'] = 'no-store'
+                    return response
+                self.db.pages.set(key, result, tag)
+            return json_response(result, etag)
 
 
 @api.route('/organizations/<id>')
-@api.param('id', 'A declaration number or a SIREN')
+@api.param('id', 'A declaration number, a SIREN or a SIRET')
 class Display(WithDb, Resource):
     @api.doc('display')
-    @api.response(404, 'No organization found matching this SIREN or this declaration number')
-    @api.marshal_with(organization)
+    @api.response(404, 'No organization found matching this SIREN, SIRET or declaration number')
+    @api.response(200, 'Success', organization)
     def get(self, id):
-        '''Get an organization given its SIREN or its declaration number'''
-        doc = self.db.get(id)
-        if not doc:
-            api.abort(404, 'No organization found matching this identifier')
+        '''Get an organization given its SIREN, its SIRET or its declaration number'''
+        metrics = self.db.metrics
+        with metrics.trace('display', id=id):
+            etag = responses.make_etag(self.db.tag, id)
+            response = responses.not_modified(etag)
+            if response is not None:
+                return response
+            data = self.db.get_json(id)
+            if not data:
+                api.abort(404, 'No organization found matching this identifier')
+            return json_response(data, etag)
+
+
+@api.route('/organizations/suggest')
+@api.expect(suggest_parser)
+class Suggest(WithDb, Resource):
+    @api.doc('suggest')
+    @api.response(200, 'Success', [suggestion])
+    def get(self):
+        '''Suggest organizations given the beginning of a word of their name'''
+        args = suggest_parser.parse_args()
+        etag = responses.make_etag(self.db.tag, cache_key(args))
+        response = responses.not_modified(etag)
+        if response is not None:
+            return response
+        suggestions = self.db.suggest(args['prefix'], limit=args['limit'])
+        return json_response(serializer.dumps(marshal(suggestions, suggestion)), etag)
+
+
+@api.route('/organizations/export')
+@api.expect(export_parser)
+class Export(WithDb, Resource):
+    @api.doc('export')
+    def get(self):
+        '''Stream every organization, gzipped if accepted by the client'''
+        args = export_parser.parse_args()
+        etag = responses.make_etag(self.db.tag, cache_key(args))
+        response = responses.not_modified(etag)
+        if response is not None:
+            return response
+        compress = 'gzip' in request.accept_encodings
+        orgs = self.db.export(args['q'], postal_code=args['postal_code'], department=args['department'])
+        stream = export.serialize(orgs, args['format'], gzip=compress)
+        filename = 'organizations.{0}'.format(args['format'])
+        response = Response(stream, mimetype=export.MIMETYPES[args['format']])
+        response.headers['Content-Disposition'] = 'attachment; filename="{0}"'.format(filename)
+        response.set_etag(responses.representation_etag(etag, 'gzip' if compress else None))
+        response.vary.add('Accept-Encoding')
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+
+@api.route('/organizations/batch')
+class Batch(WithDb, Resource):
+    @api.doc('batch', params={'format': 'Use "ndjson" to stream one result per line'})
+    @api.expect(batch_request)
+    @api.response(200, 'Success', batch_results)
+    @api.response(400, 'Invalid identifiers list or too many identifiers')
+    @api.response(503, 'Too many requests in progress')
+    @limited
+    def post(self):
+        '''Get many organizations given their SIREN, SIRET or declaration number'''
+        data = request.get_json(silent=True) or {}
+        ids = data.get('ids')
+        if not isinstance(ids, list) or not all(isinstance(id, str) for id in ids):
+            api.abort(400, 'Expected a list of identifiers as "ids"')
+        max_batch = self.db.config.max_batch or DEFAULT_MAX_BATCH
+        if len(ids) > max_batch:
+            api.abort(400, 'Too many identifiers, the limit is {0}'.format(max_batch))
+        ndjson = (request.args.get('format') == 'ndjson'
+                  or request.accept_mimetypes.best == NDJSON_MIMETYPE)
+        if ndjson:
+            return Response(self.stream(self.db, ids), mimetype=NDJSON_MIMETYPE)
+        orgs = self.db.get_many(ids)
+        return {'results': [marshal(self.item(id, org), batch_item) for id, org in zip(ids, orgs)]}
+
+    def item(self, id, org):
+        return {'id': id, 'found': org is not None, 'organization': org}
+
+    def stream(self, db, ids):
+        '''Resolve and serialize identifiers by chunks, outside of the application context'''
+        for start in range(0, len(ids), BATCH_CHUNK_SIZE):
+            chunk = ids[start:start + BATCH_CHUNK_SIZE]
+            for id, org in zip(chunk, db.get_many(chunk)):
+                yield json.dumps(marshal(self.item(id, org), batch_item)) + '\n'
 
 
 @api.route('/specialties/')
@@ -81,4 +324,20 @@ class Specialties(WithDb, Resource):
     @api.doc('specialties')
     def get(self):
         '''Map specialties code to their label'''
-        return self.db.specialties
+        return current_app.extensions['specialties'].response()
+
+
+@api.route('/status/')
+class Status(WithDb, Resource):
+    @api.doc('status')
+    def get(self):
+        '''Expose the index generation and cache statistics'''
+        return self.db.stats()
+
+
+@api.route('/metrics')
+class Metrics(WithDb, Resource):
+    @api.doc('metrics')
+    def get(self):
+        '''Expose the requests timings and index statistics in the Prometheus text format'''
+        return Response(self.db.metrics.render(self.db.stats()), content_type=PROMETHEUS_MIMETYPE)
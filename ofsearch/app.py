@@ -0,0 +1,23 @@
+from flask import Flask, request
+
+from . import responses, serializer
+from .api import DEFAULT_MAX_CONCURRENT, Limiter, api
+
+
+def create_app(db):
+    '''Build the API application serving a given `DB`'''
+    app = Flask('ofsearch')
+    app.config['SWAGGER_UI_DOC_EXPANSION'] = 'list'
+    api.init_app(app)
+    db.init_app(app)
+    max_concurrent = DEFAULT_MAX_CONCURRENT if db.config.max_concurrent is None else db.config.max_concurrent
+    app.extensions['limiter'] = Limiter(max_concurrent)
+    app.extensions['cache_control'] = cache_control = responses.parse_cache_control(db.config.cache_control)
+    app.extensions['specialties'] = responses.Precompressed(serializer.dumps(db.specialties) + b'\n')
+
+    @app.after_request
+    def finalize(response):
+        endpoint = request.url_rule.endpoint if request.url_rule else None
+        return responses.finalize(response, cache_control.get(endpoint))
+
+    return app
@@ -0,0 +1,216 @@
+'''
+ASGI entry point dispatching the API requests to executors.
+
+The Flask application is left untouched (same routes, models, caching and limits):
+each request is converted into a WSGI call run outside of the event loop.
+
+- searches and batch lookups run in a pool of processes, forked once the index and side stores are preloaded,
+  so they share them copy-on-write and use as many cores as processes
+- other requests (display, suggestions, export...) run in a pool of threads of the main process,
+  so cheap lookups keep being answered while expensive searches are running
+
+Searches waiting for a process are bounded, exceeding ones are answered with a `503`.
+The timings and counters recorded by the pool processes are merged into the main process metrics.
+
+    uvicorn --factory ofsearch.asgi:from_env
+'''
+import asyncio
+import io
+import logging
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .api import RETRY_AFTER
+from .app import create_app
+from .database import DB
+from .utils import ObjectDict
+
+log = logging.getLogger(__name__)
+
+DEFAULT_THREADS = 8
+# Searches waiting per process before answering with a 503
+DEFAULT_QUEUE = 4
+# Requests handled by the processes pool: (method, path)
+PROCESSED = (
+    ('GET', '/organizations/'),
+    ('POST', '/organizations/batch'),
+)
+CHUNK_SIZE = 64 * 1024
+
+# The application inherited from the parent process or built by a pool process, and its process
+_app = None
+_pid = None
+
+
+def worker_app(config):
+    '''The application of the current pool process, built from `config` unless inherited by fork'''
+    global _app, _pid
+    if _pid != os.getpid():
+        if _app is None:
+            _app = create_app(DB(config))
+        else:
+            _app.extensions['db'].after_fork()
+        _pid = os.getpid()
+    return _app
+
+
+def to_environ(scope, body):
+    '''Build a WSGI environ (without its streams so it can be pickled) from an ASGI HTTP scope'''
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{0}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name == 'CONTENT_TYPE':
+            environ[name] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def call(app, environ, body):
+    '''Call a WSGI application, returning its status code, its headers and its body iterator'''
+    environ = dict(environ, **{'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr})
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(' ', 1)[0]), headers]
+
+    chunks = app(environ, start_response)
+    return started[0], started[1], chunks
+
+
+def process(config, environ, body):
+    '''Handle a request in a pool process, with a buffered body and the metrics it recorded'''
+    app = worker_app(config)
+    status, headers, chunks = call(app, environ, body)
+    try:
+        data = b''.join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    db = app.extensions['db']
+    metrics = db.metrics.collect({'queries': db.queries.stats(), 'pages': db.pages.stats()})
+    return status, headers, data, metrics
+
+
+def warm(config):
+    '''Open the application of a pool process'''
+    worker_app(config)
+
+
+def encode_headers(headers):
+    return [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+
+class Application(object):
+    '''An ASGI application serving a Flask application from processes and threads pools'''
+    def __init__(self, app, workers=None, threads=DEFAULT_THREADS, queue=DEFAULT_QUEUE):
+        global _app, _pid
+        self.app = _app = app
+        _pid = os.getpid()
+        self.db = app.extensions['db']
+        self.config = ObjectDict(self.db.config)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = self.workers * queue
+        self.pending = 0
+        # Fork the pool processes while there is no thread yet, once the read-only data is loaded
+        self.db.preload()
+        self.processes = ProcessPoolExecutor(self.workers)
+        for future in [self.processes.submit(warm, self.config) for _ in range(self.workers)]:
+            future.result()
+        log.info('Serving with %s search processes and %s threads', self.workers, threads)
+        self.threads = ThreadPoolExecutor(threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.processes.shutdown()
+                self.threads.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive):
+        body = []
+        while True:
+            message = await receive()
+            body.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(body)
+
+    async def http(self, scope, receive, send):
+        body = await self.read_body(receive)
+        environ = to_environ(scope, body)
+        loop = asyncio.get_event_loop()
+        if (scope['method'], scope['path']) in PROCESSED:
+            if self.pending >= self.max_pending:
+                self.db.metrics.rejected += 1
+                await self.respond(send, 503, [('Content-Type', 'application/json'),
+                                               ('Retry-After', str(RETRY_AFTER))],
+                                   b'{"message": "Too many requests in progress, retry later"}\n')
+                return
+            self.pending += 1
+            try:
+                status, headers, data, metrics = await loop.run_in_executor(
+                    self.processes, process, self.config, environ, body)
+            finally:
+                self.pending -= 1
+            self.db.metrics.merge(metrics)
+            await self.respond(send, status, headers, data)
+            return
+        status, headers, chunks = await loop.run_in_executor(self.threads, call, self.app, environ, body)
+        await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+        iterator = iter(chunks)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.threads, next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def respond(self, send, status, headers, body):
+        await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+        for start in range(0, max(len(body), 1), CHUNK_SIZE):
+            more = start + CHUNK_SIZE < len(body)
+            await send({'type': 'http.response.body', 'body': body[start:start + CHUNK_SIZE], 'more_body': more})
+
+
+def from_env():
+    '''Build the ASGI application from the `OFSEARCH_`-prefixed environment variables'''
+    from .heroku import app
+    workers = int(os.environ.get('OFSEARCH_WORKERS', 0)) or None
+    threads = int(os.environ.get('OFSEARCH_THREADS', DEFAULT_THREADS))
+    return Application(app, workers=workers, threads=threads)
@@ -0,0 +1,564 @@
+'''
+Benchmarks and synthetic datasets.
+'''
+import csv
+import http.client
+import itertools
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from urllib.parse import urlencode
+
+from flask_restplus import marshal
+from whoosh import fields, index
+
+from . import readers, serializer, spelling
+from .analysis import PROFILES
+from .api import organization
+from .app import create_app
+from .database import (
+    DB, DATASET_HEADER, LEGACY_SPECIALTIES_FIELDS, SPECIALTIES_KEYS, Organization,
+    legacy_specialties, normalize, normalize_batch, unpack_specialties
+)
+from .utils import ObjectDict
+
+PERCENTILES = (50, 95, 99)
+SERVING_PORT = 8899
+SERVING_TIMEOUT = 60  # in seconds
+# Synthetic requests mix weights
+MIX = (
+    ('search', 6),
+    ('get', 3),
+    ('specialties', 1),
+)
+
+NAME_WORDS = (
+    'formation', 'conseil', 'institut', 'ecole', 'centre', 'association', 'academie', 'groupe',
+    'developpement', 'management', 'langues', 'informatique', 'sante', 'securite', 'batiment',
+    'transport', 'commerce', 'social', 'sport', 'culture', 'france', 'europe', 'lyon', 'paris',
+    'marseille', 'bretagne', 'normandie', 'provence', 'alpes', 'atlantique', 'services', 'competences',
+)
+DEPARTMENTS = ['{0:02d}'.format(i) for i in range(1, 96) if i != 20] + ['2A', '2B', '971', '972', '973', '974']
+SPECIALTY_CODES = (100, 110, 111, 200, 220, 230, 310, 312, 314, 320, 330, 331, 332, 333, 334, 335, 410, 413, 415)
+
+
+def postal_code(department, rng):
+    if department in ('2A', '2B'):
+        return '20{0:03d}'.format(rng.randint(0, 299) if department == '2A' else rng.randint(600, 620))
+    return (department + '{0:03d}'.format(rng.randint(0, 999)))[:5]
+
+
+def generate_rows(count, seed=42):
+    '''Generate a synthetic dataset shaped like the official one, header first'''
+    rng = random.Random(seed)
+    yield DATASET_HEADER
+    for i in range(count):
+        department = rng.choice(DEPARTMENTS)
+        code = postal_code(department, rng)
+        city = rng.choice(NAME_WORDS).upper()
+        row = [
+            '{0:011d}'.format(11000000000 + i),
+            str(rng.randint(0, 200)),
+            '{0:09d}'.format(300000000 + i),
+            '{0:05d}'.format(rng.randint(1, 99999)),
+            ' '.join(rng.sample(NAME_WORDS, rng.randint(1, 4))).upper(),
+            '{0} rue {1}'.format(rng.randint(1, 200), rng.choice(NAME_WORDS)),
+            None,
+            code,
+            city,
+            'BP {0}'.format(rng.randint(1, 999)),
+            None,
+            code,
+            city,
+        ]
+        nb_specialties = rng.randint(0, 5)
+        for j in range(len(SPECIALTIES_KEYS)):
+            if j < nb_specialties:
+                row.extend((rng.choice(SPECIALTY_CODES), rng.randint(0, 2000), rng.randint(0, 100000)))
+            else:
+                row.extend((None, None, None))
+        yield tuple(row)
+
+
+def generate_docs(count, seed=42):
+    '''Generate normalized synthetic organizations'''
+    rows = generate_rows(count, seed)
+    header = next(rows)
+    for row in rows:
+        yield normalize(dict(zip(header, row)))
+
+
+def legacy_schema():
+    '''The schema used before specialties packing'''
+    legacy = Organization()
+    legacy.remove('specialties')
+    for name in LEGACY_SPECIALTIES_FIELDS:
+        legacy.add(name, fields.NUMERIC(stored=True), glob=True)
+    return legacy
+
+
+def to_legacy(doc):
+    '''Convert a normalized organization into the legacy layout'''
+    doc = dict(doc)
+    for keys, specialty in zip(SPECIALTIES_KEYS, unpack_specialties(doc.pop('specialties'))):
+        for key, attr in zip(keys, ('code', 'trainees', 'hours')):
+            if specialty[attr] is not None:
+                doc[key] = specialty[attr]
+    return doc
+
+
+def measure_storage(schema, docs, decode):
+    '''Index `docs` in a temporary index and measure the stored fields size and decoding time'''
+    path = tempfile.mkdtemp()
+    try:
+        ix = index.create_in(path, schema)
+        start = time.perf_counter()
+        writer = ix.writer(compound=False)
+        for doc in docs:
+            writer.add_document(**doc)
+        writer.commit()
+        index_time = time.perf_counter() - start
+        stored = sum(os.path.getsize(os.path.join(path, name))
+                     for name in os.listdir(path) if name.endswith('._stored.col'))
+        with ix.searcher() as s:
+            start = time.perf_counter()
+            for _, values in s.reader().iter_docs():
+                decode(values)
+            decode_time = time.perf_counter() - start
+        return {
+            'stored_bytes': stored,
+            'index_seconds': round(index_time, 3),
+            'decode_seconds': round(decode_time, 3),
+            'decode_us_per_doc': round(decode_time * 1e6 / max(len(docs), 1), 2),
+        }
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def bench_specialties(count, seed=42):
+    '''Compare the legacy glob fields specialties storage with the packed one'''
+    docs = list(generate_docs(count, seed))
+    legacy = measure_storage(legacy_schema(), [to_legacy(doc) for doc in docs], legacy_specialties)
+    packed = measure_storage(Organization(), docs, lambda fields: unpack_specialties(fields['specialties']))
+    return {
+        'documents': count,
+        'legacy': legacy,
+        'packed': packed,
+        'stored_ratio': round(packed['stored_bytes'] / max(legacy['stored_bytes'], 1), 3),
+        'decode_ratio': round(packed['decode_seconds'] / max(legacy['decode_seconds'], 1e-9), 3),
+    }
+
+
+def percentile(values, rank):
+    '''Nearest-rank percentile of sorted values'''
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(rank / 100 * len(values))) - 1))
+    return values[index]
+
+
+def latency_stats(durations):
+    '''Summarize durations (in seconds) as milliseconds statistics'''
+    durations = sorted(durations)
+    stats = {'count': len(durations)}
+    if durations:
+        stats['mean'] = round(sum(durations) * 1000 / len(durations), 3)
+        for rank in PERCENTILES:
+            stats['p{0}'.format(rank)] = round(percentile(durations, rank) * 1000, 3)
+    return stats
+
+
+def peak_rss():
+    '''Peak resident memory of this process and its children (in Mb)'''
+    scale = 1024 if os.uname().sysname != 'Darwin' else 1024 * 1024
+    return {
+        'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def read_log(filename):
+    '''
+    Read a JSON lines query log.
+
+    Each line is an object with a `path` (or `url`) including the query string
+    and optionally a `method` and a JSON `body`.
+    '''
+    requests = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            requests.append({
+                'method': entry.get('method', 'GET').upper(),
+                'path': entry.get('path') or entry['url'],
+                'body': entry.get('body'),
+            })
+    return requests
+
+
+def synthetic_requests(db, count, seed=42):
+    '''Generate a mix of search, get and specialties requests against an existing index'''
+    rng = random.Random(seed)
+    identifiers = []
+    words = set()
+    for org in db.export():
+        identifiers.extend(i for i in (org.get('numero_de_da'), org.get('da_siren')) if i)
+        words.update((org.get('da_raison_sociale') or '').lower().split())
+        if len(identifiers) >= 10000:
+            break
+    words = sorted(words) or list(NAME_WORDS)
+    kinds = [kind for kind, weight in MIX for _ in range(weight)]
+    requests = []
+    for _ in range(count):
+        kind = rng.choice(kinds)
+        if kind == 'search':
+            word = rng.choice(words)
+            query = word[:rng.randint(3, max(3, len(word)))]
+            path = '/organizations/?' + urlencode({'q': query, 'page': rng.choice((1, 1, 1, 2))})
+        elif kind == 'get' and identifiers:
+            path = '/organizations/{0}'.format(rng.choice(identifiers))
+        else:
+            path = '/specialties/'
+        requests.append({'method': 'GET', 'path': path, 'body': None})
+    return requests
+
+
+class HttpClient(object):
+    '''A minimal HTTP client with a persistent connection, answering like the Flask test client'''
+    def __init__(self, port, host='127.0.0.1'):
+        self.connection = http.client.HTTPConnection(host, port)
+
+    def open(self, path, method='GET', data=None, content_type=None):
+        headers = {'Content-Type': content_type} if content_type else {}
+        self.connection.request(method, path, body=data, headers=headers)
+        response = self.connection.getresponse()
+        response.status_code = response.status
+        response.get_data = response.read
+        return response
+
+    def post(self, path, **kwargs):
+        return self.open(path, method='POST', **kwargs)
+
+
+def replay(app, requests, concurrency=1, port=None):
+    '''
+    Replay requests against an application in-process from `concurrency` threads,
+    or over HTTP against a server listening on `port`.
+
+    Report the throughput and the latency percentiles per endpoint.
+    '''
+    adapter = app.url_map.bind('localhost')
+    durations = {}
+    errors = {}
+    lock = threading.Lock()
+    queue = list(reversed(requests))
+
+    def endpoint(path, method):
+        try:
+            return adapter.match(path.split('?', 1)[0], method=method)[0].split('.')[-1]
+        except Exception:
+            return 'unknown'
+
+    def worker():
+        client = app.test_client() if port is None else HttpClient(port)
+        while True:
+            with lock:
+                if not queue:
+                    return
+                request = queue.pop()
+            name = endpoint(request['path'], request['method'])
+            start = time.perf_counter()
+            if request['method'] == 'POST':
+                response = client.post(request['path'], data=json.dumps(request['body']),
+                                       content_type='application/json')
+            else:
+                response = client.open(request['path'], method=request['method'])
+            response.get_data()
+            duration = time.perf_counter() - start
+            with lock:
+                durations.setdefault(name, []).append(duration)
+                if response.status_code >= 500:
+                    errors[name] = errors.get(name, 0) + 1
+
+    threads = [threading.Thread(target=worker) for _ in range(max(concurrency, 1))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    endpoints = {}
+    for name, values in durations.items():
+        endpoints[name] = latency_stats(values)
+        endpoints[name]['errors'] = errors.get(name, 0)
+    return {
+        'requests': len(requests),
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(requests) / elapsed, 1) if elapsed else None,
+        'latency': latency_stats([d for values in durations.values() for d in values]),
+        'endpoints': endpoints,
+    }
+
+
+def bench_queries(config, log=None, count=1000, concurrency=1, seed=42):
+    '''Replay a query log or a synthetic requests mix against the application'''
+    db = DB(config)
+    app = create_app(db)
+    requests = read_log(log) if log else synthetic_requests(db, count, seed)
+    results = replay(app, requests, concurrency)
+    results['source'] = log or 'synthetic'
+    results['caches'] = db.stats()['caches']
+    return results
+
+
+def segments_size(stats):
+    '''The size of the Whoosh segments files given `DB.index_stats`, without the side stores'''
+    return sum(sum(segment['files'].values()) for segment in stats['segments'])
+
+
+def bench_load(count, max_memory=1024, workers=0, batch_size=readers.DEFAULT_BATCH_SIZE, seed=42):
+    '''Measure a full load of a generated dataset: time, index size and peak memory'''
+    path = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(path, 'dataset.csv')
+        with open(filename, 'w', newline='') as f:
+            csv.writer(f, delimiter=';').writerows(generate_rows(count, seed))
+        db = DB(ObjectDict(index=os.path.join(path, 'index')))
+        start = time.perf_counter()
+        header, rows, _ = readers.read(filename)
+        with db.indexing(max_memory):
+            for batch in readers.process(normalize_batch, header, rows, workers, batch_size):
+                for org in batch:
+                    db.save_organization(org)
+        elapsed = time.perf_counter() - start
+        stats = db.index_stats()
+        return {
+            'rows': count,
+            'workers': workers,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(count / elapsed, 1) if elapsed else None,
+            'segments_bytes': segments_size(stats),
+            'stores_bytes': stats['bytes']['stores'],
+            'dataset_bytes': os.path.getsize(filename),
+            'peak_rss_mb': peak_rss(),
+        }
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def wait_for(port, process, timeout=SERVING_TIMEOUT):
+    '''Wait for a server to answer on `port`'''
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError('Server exited with code {0}'.format(process.returncode))
+        try:
+            HttpClient(port).open('/status/').get_data()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('Server not ready after {0}s'.format(timeout))
+
+
+def bench_serving(config, count=2000, concurrency=16, workers=None, seed=42):
+    '''
+    Compare the throughput of the gunicorn gevent workers and of the asynchronous server
+    with as many workers (search processes) on the current index, over HTTP.
+    '''
+    workers = workers or os.cpu_count() or 1
+    db = DB(config)
+    app = create_app(db)
+    requests = synthetic_requests(db, count, seed)
+    env = dict(os.environ, OFSEARCH_WORKERS=str(workers))
+    for key, value in config.items():
+        if isinstance(value, (str, int)) and not isinstance(value, bool):
+            env['OFSEARCH_' + key.upper()] = str(value)
+    servers = {
+        'gevent': ['gunicorn', 'ofsearch.heroku:app', '-c', 'python:ofsearch.gunicorn',
+                   '-w', str(workers), '-b', '127.0.0.1:{0}'.format(SERVING_PORT)],
+        'async': ['uvicorn', '--factory', 'ofsearch.asgi:from_env', '--port', str(SERVING_PORT),
+                  '--log-level', 'warning'],
+    }
+    results = {'requests': count, 'concurrency': concurrency, 'workers': workers, 'servers': {}}
+    for name, command in sorted(servers.items()):
+        try:
+            __import__(command[0])
+        except ImportError:
+            results['servers'][name] = {'skipped': '{0} is not installed'.format(command[0])}
+            continue
+        process = subprocess.Popen([sys.executable, '-m'] + command, env=env)
+        try:
+            wait_for(SERVING_PORT, process)
+            results['servers'][name] = replay(app, requests, concurrency, port=SERVING_PORT)
+        finally:
+            process.terminate()
+            process.wait()
+    return results
+
+
+def analyzer_queries(count, seed=42):
+    '''Generate name queries: whole words, word prefixes and words pairs'''
+    rng = random.Random(seed)
+    queries = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            queries.append(rng.choice(NAME_WORDS))
+        elif kind == 1:
+            word = rng.choice(NAME_WORDS)
+            queries.append(word[:rng.randint(3, max(3, len(word) - 1))])
+        else:
+            queries.append(' '.join(rng.sample(NAME_WORDS, 2)))
+    return queries
+
+
+def bench_analyzers(count, queries=300, max_memory=1024, seed=42):
+    '''Compare the index size, load time and query latency of every analysis profile on the same dataset'''
+    path = tempfile.mkdtemp()
+    try:
+        docs = list(generate_docs(count, seed))
+        sample = analyzer_queries(queries, seed)
+        results = {'documents': count, 'queries': queries, 'profiles': {}}
+        for profile in PROFILES:
+            db = DB(ObjectDict(index=os.path.join(path, profile), cache_size=0))
+            start = time.perf_counter()
+            with db.indexing(max_memory, analyzer=profile):
+                for doc in docs:
+                    db.save_organization(doc)
+            elapsed = time.perf_counter() - start
+            durations, hits = [], 0
+            for q in sample:
+                start = time.perf_counter()
+                hits += db.search(q, limit=20)['total']
+                durations.append(time.perf_counter() - start)
+            results['profiles'][profile] = {
+                'load_seconds': round(elapsed, 3),
+                'segments_bytes': segments_size(db.index_stats()),
+                'latency_ms': latency_stats(durations),
+                'mean_hits': round(hits / max(len(sample), 1), 1),
+            }
+        return results
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def bench_serializer(config, limit=100, rounds=100):
+    '''
+    Check that every pre-serialized organization matches its marshalled API output
+    and compare the cost of both ways of serializing a page of `limit` results.
+    '''
+    db = DB(config)
+    documents = db.stores.documents
+    if documents is None:
+        raise ValueError('No documents store for this index, run `ofsearch migrate` to build it')
+    results = {'library': 'rapidjson' if serializer.rapidjson else 'json', 'documents': 0, 'identical': 0,
+               'mismatches': []}
+    with db.searcher() as s:
+        for docnum, stored in s.reader().iter_docs():
+            expected = json.dumps(marshal(db.doc_to_org(stored), organization))
+            data = documents[docnum]
+            results['documents'] += 1
+            if data == expected.encode('utf8'):
+                results['identical'] += 1
+            elif json.loads(data.decode('utf8')) != json.loads(expected):
+                results['mismatches'].append(docnum)
+        docnums = list(itertools.islice(s.document_numbers(), limit))
+        start = time.perf_counter()
+        for _ in range(rounds):
+            json.dumps([marshal(db.doc_to_org(s.stored_fields(docnum)), organization) for docnum in docnums])
+        marshalled = (time.perf_counter() - start) / rounds
+        start = time.perf_counter()
+        for _ in range(rounds):
+            b'[' + serializer.SEPARATOR.join(documents[docnum] for docnum in docnums) + b']'
+        preserialized = (time.perf_counter() - start) / rounds
+    results.update({
+        'equivalent': results['documents'] - len(results['mismatches']),
+        'limit': len(docnums),
+        'marshal_ms': round(marshalled * 1000, 3),
+        'preserialized_ms': round(preserialized * 1000, 3),
+        'speedup': round(marshalled / preserialized, 1) if preserialized else None,
+    })
+    return results
+
+
+def misspell(word, rng):
+    '''Apply a random typing error to a word: a deletion, an insertion, a substitution or a transposition'''
+    i = rng.randrange(len(word))
+    letter = rng.choice('abcdefghijklmnopqrstuvwxyz')
+    kind = rng.randrange(4)
+    if kind == 0:
+        return word[:i] + word[i + 1:]
+    elif kind == 1:
+        return word[:i] + letter + word[i:]
+    elif kind == 2:
+        return word[:i] + letter + word[i + 1:]
+    i = min(i, len(word) - 2)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def fuzzy_queries(db, count, seed=42):
+    '''Generate `(query, identifier, word, misspelled)` with a misspelled word from the names of the index'''
+    rng = random.Random(seed)
+    candidates = []
+    for org in db.export():
+        words = spelling.words(org.get('da_raison_sociale'))
+        names = [w for w in words if len(w) >= spelling.MIN_LENGTH and w.isalpha()]
+        if names:
+            candidates.append((org['numero_de_da'], words, names))
+    queries = []
+    for identifier, words, names in rng.sample(candidates, min(count, len(candidates))):
+        word = rng.choice(names)
+        misspelled = misspell(word, rng)
+        queries.append((' '.join(misspelled if w == word else w for w in words), identifier, word, misspelled))
+    return queries
+
+
+def bench_fuzzy(config, queries=300, limit=20, seed=42):
+    '''
+    Compare the recall and the latency of the plain and fuzzy searches
+    on organization names with a typing error.
+
+    The recall is the share of queries finding the misspelled organization in their first `limit` results.
+    '''
+    db = DB(ObjectDict(config, cache_size=0))
+    speller = db.stores.speller
+    if speller is None:
+        raise ValueError('No spelling dictionary for this index, run `ofsearch migrate` to build it')
+    sample = fuzzy_queries(db, queries, seed)
+    results = {'queries': len(sample), 'limit': limit, 'vocabulary': len(speller.words)}
+    durations, fixed = [], 0
+    for _, _, word, misspelled in sample:
+        start = time.perf_counter()
+        correction = speller.correct(misspelled)
+        durations.append(time.perf_counter() - start)
+        fixed += correction == word
+    results['correction'] = {
+        'accuracy': round(fixed / max(len(sample), 1), 3),
+        'latency_us': dict((k, round(v * 1000, 1)) for k, v in latency_stats(durations).items() if k != 'count'),
+    }
+    for mode, fuzzy in (('plain', False), ('fuzzy', True)):
+        durations, found, hits = [], 0, 0
+        for query, identifier, _, _ in sample:
+            start = time.perf_counter()
+            result = db.search(query, limit=limit, fuzzy=fuzzy)
+            durations.append(time.perf_counter() - start)
+            found += any(org['numero_de_da'] == identifier for org in result['results'])
+            hits += result['total']
+        results[mode] = {
+            'recall': round(found / max(len(sample), 1), 3),
+            'mean_hits': round(hits / max(len(sample), 1), 1),
+            'latency_ms': latency_stats(durations),
+        }
+    return results
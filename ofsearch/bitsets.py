@@ -0,0 +1,143 @@
+'''
+Precomputed document sets stored as bitsets.
+
+A bitset is backed by a Python integer so intersections, unions
+and cardinalities are computed in C over the whole index.
+'''
+import os
+import struct
+
+from whoosh.idsets import DocIdSet
+
+MAGIC = b'OFBS1'
+HEADER = struct.Struct('<5sI')
+KEY = struct.Struct('<H')
+LENGTH = struct.Struct('<I')
+
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+else:
+    def popcount(value):
+        return bin(value).count('1')
+
+
+class Bitset(DocIdSet):
+    '''An immutable set of document numbers usable as a Whoosh search filter'''
+    def __init__(self, bits=0):
+        self.bits = bits
+        self._bytes = None
+
+    @classmethod
+    def from_docnums(cls, docnums):
+        buf = bytearray()
+        for docnum in docnums:
+            index = docnum >> 3
+            if index >= len(buf):
+                buf.extend(bytes(index - len(buf) + 1))
+            buf[index] |= 1 << (docnum & 7)
+        return cls(int.from_bytes(bytes(buf), 'little'))
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(int.from_bytes(data, 'little'))
+
+    def to_bytes(self):
+        if self._bytes is None:
+            self._bytes = self.bits.to_bytes((self.bits.bit_length() + 7) // 8, 'little')
+        return self._bytes
+
+    def __and__(self, other):
+        return Bitset(self.bits & other.bits)
+
+    def __or__(self, other):
+        return Bitset(self.bits | other.bits)
+
+    def __len__(self):
+        return popcount(self.bits)
+
+    def __bool__(self):
+        return self.bits != 0
+
+    def __contains__(self, docnum):
+        data = self.to_bytes()
+        index = docnum >> 3
+        return index < len(data) and bool(data[index] & (1 << (docnum & 7)))
+
+    def __iter__(self):
+        for index, byte in enumerate(self.to_bytes()):
+            if not byte:
+                continue
+            base = index << 3
+            for bit in range(8):
+                if byte & (1 << bit):
+                    yield base + bit
+
+    def __repr__(self):
+        return '<Bitset of {0} documents>'.format(len(self))
+
+
+def intersection(bitsets):
+    '''Intersect several bitsets, `None` if there is no bitset'''
+    result = None
+    for bitset in bitsets:
+        result = bitset if result is None else result & bitset
+    return result
+
+
+def union(bitsets):
+    '''Unite several bitsets'''
+    bits = 0
+    for bitset in bitsets:
+        bits |= bitset.bits
+    return Bitset(bits)
+
+
+class BitsetsWriter(object):
+    '''Build and write a mapping of string keys to bitsets'''
+    def __init__(self, filename):
+        self.filename = filename
+        self._bitsets = {}
+
+    def add(self, docnum, keys):
+        '''Add a document to the bitsets of the given keys'''
+        index, mask = docnum >> 3, 1 << (docnum & 7)
+        for key in keys:
+            buf = self._bitsets.get(key)
+            if buf is None:
+                buf = self._bitsets[key] = bytearray()
+            if index >= len(buf):
+                buf.extend(bytes(index - len(buf) + 1))
+            buf[index] |= mask
+
+    def close(self):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, len(self._bitsets)))
+            for key, buf in sorted(self._bitsets.items()):
+                encoded = key.encode('utf8')
+                out.write(KEY.pack(len(encoded)))
+                out.write(encoded)
+                out.write(LENGTH.pack(len(buf)))
+                out.write(buf)
+        os.replace(tmp, self.filename)
+
+
+def read_bitsets(filename):
+    '''Read a mapping of string keys to bitsets'''
+    with open(filename, 'rb') as f:
+        data = f.read()
+    magic, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('{0} is not a bitsets file'.format(filename))
+    bitsets = {}
+    offset = HEADER.size
+    for _ in range(count):
+        size, = KEY.unpack_from(data, offset)
+        offset += KEY.size
+        key = data[offset:offset + size].decode('utf8')
+        offset += size
+        size, = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        bitsets[key] = Bitset.from_bytes(data[offset:offset + size])
+        offset += size
+    return bitsets
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 300  # in seconds
+
+
+class LRUCache(object):
+    '''
+    A thread-safe bounded LRU cache with an optional time-to-live.
+
+    Each entry is tagged with the index version and generation it has been computed from
+    and is considered stale as soon as they change.
+    '''
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, generation=None):
+        '''Get a cached value or `None` if missing, expired or stale'''
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                tag, expires, value = entry
+                if tag == generation and (expires is None or expires > time.monotonic()):
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+        return None
+
+    def set(self, key, value, generation=None):
+        '''Store a value, evicting the least recently used entries if needed'''
+        if not self.maxsize:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (generation, expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        '''Expose the cache counters'''
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
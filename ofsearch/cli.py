@@ -1,17 +1,24 @@
 # -*- coding: utf-8 -*-
+import json
 import logging
 import os
+import pstats
 import sys
-
-from urllib.request import urlopen, Request, urlretrieve
+import time
 
 import click
 
-from flask import Flask
-from openpyxl import load_workbook
-
-from .api import api
-from .database import DB, DEFAULT_INDEX
+from . import benchmarks, download, export, profiling, readers
+from .analysis import PROFILES
+from .api import DEFAULT_MAX_BATCH, DEFAULT_MAX_CONCURRENT, SORTS
+from .app import create_app
+from .asgi import DEFAULT_THREADS, Application
+from .cache import DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL
+from .database import (
+    DB, DEFAULT_GRACE_PERIOD, DEFAULT_INDEX, DEFAULT_MAX_SEGMENTS, DEFAULT_POOL_SIZE, DEFAULT_QUERY_SYNTAX,
+    DEFAULT_TIME_LIMIT, QUERY_SYNTAXES, normalize_batch
+)
+from .metrics import DEFAULT_SLOW_QUERY
 from .utils import ObjectDict, is_tty
 
 
@@ -108,6 +115,26 @@ class ClickFormatter(logging.Formatter):
 @click.option('-v', '--verbose', is_flag=True, help='Verbose output')
 @click.option('-i', '--index', default=DEFAULT_INDEX, type=click.Path(writable=True),
               help='Index storage directory')
+@click.option('--cache-size', default=DEFAULT_CACHE_SIZE, type=int,
+              help='Max number of cached queries and result pages (0 to disable)')
+@click.option('--cache-ttl', default=DEFAULT_CACHE_TTL, type=int,
+              help='Cached queries and result pages lifetime (in seconds)')
+@click.option('--cache-control', default='',
+              help='Cache-Control headers per endpoint (ie. "search=no-cache; specialties=public, max-age=604800")')
+@click.option('--searchers', default=DEFAULT_POOL_SIZE, type=int,
+              help='Max number of idle index searchers kept open per process')
+@click.option('--max-batch', default=DEFAULT_MAX_BATCH, type=int,
+              help='Max number of identifiers per batch lookup')
+@click.option('--grace-period', default=DEFAULT_GRACE_PERIOD, type=int,
+              help='Delay before removing a replaced index version (in seconds)')
+@click.option('--slow-query', default=DEFAULT_SLOW_QUERY, type=int,
+              help='Log requests slower than this duration (in milliseconds, 0 to disable)')
+@click.option('--time-limit', default=DEFAULT_TIME_LIMIT, type=int,
+              help='Return partial results of searches longer than this duration (in milliseconds, 0 to disable)')
+@click.option('--query-syntax', default=DEFAULT_QUERY_SYNTAX, type=click.Choice(QUERY_SYNTAXES),
+              help='Allow the full query syntax or only its cheap subset')
+@click.option('--max-concurrent', default=DEFAULT_MAX_CONCURRENT, type=int,
+              help='Max number of searches processed at once by a worker (0 for unlimited)')
 @click.pass_context
 def cli(ctx, **kwargs):
     '''Elasticsearch loader for SIRENE dataset'''
@@ -128,85 +155,213 @@ def cli(ctx, **kwargs):
 @cli.command()
 @click.argument('filename', type=click.Path())
 @click.option('-m', '--memory', type=int, help="Limit memory usage (in Mb)", default=1024)
+@click.option('-f', '--format', 'fmt', type=click.Choice(sorted(readers.READERS)),
+              help='Dataset format (guessed from the extension by default)')
+@click.option('-w', '--workers', type=int, default=0,
+              help='Number of processes normalizing rows (0 to normalize in-process)')
+@click.option('-b', '--batch-size', type=int, default=readers.DEFAULT_BATCH_SIZE,
+              help='Number of rows per normalization batch')
+@click.option('--incremental', is_flag=True,
+              help='Only index organizations added, changed or removed since the last load')
+@click.option('--max-segments', type=int, default=DEFAULT_MAX_SEGMENTS,
+              help='Optimize an incrementally loaded index above this number of segments')
+@click.option('-a', '--analyzer', type=click.Choice(list(PROFILES)),
+              help='Organization name analysis profile (the current index one by default)')
+@click.option('-d', '--download-dir', type=click.Path(file_okay=False, writable=True), default='.',
+              help='Directory to download remote datasets into')
+@click.option('--force', is_flag=True, help='Load the dataset even if the index has been built from it')
 @click.pass_obj
-def load(config, filename, memory):
+def load(config, filename, memory, fmt, workers, batch_size, incremental, max_segments, analyzer, download_dir,
+         force):
     '''Load data from a official dataset file'''
+    source = filename
     if filename.startswith('http://') or filename.startswith('https://'):
-        filename = download_with_progress(filename)
-    if not os.path.exists(filename):
+        try:
+            downloaded = download_with_progress(filename, download_dir)
+        except OSError as e:
+            click.echo(' '.join([red(KO), white('Download failed, run again to resume it: {0}'.format(e))]))
+            sys.exit(1)
+        filename, digest = downloaded.filename, downloaded.sha256
+    elif os.path.exists(filename):
+        digest = download.sha256sum(filename)
+    else:
         click.echo(' '.join([red(KO), white('Unable to find file {0}'.format(filename))]))
         sys.exit(1)
-    wb = load_workbook(filename, read_only=True)
-    sheet = wb.active  # Only the first sheet is relevant
     db = DB(config)
-    total = sheet.max_row - 1
-    with db.indexing(memory) as infos:
-        with click.progressbar(sheet.rows, label=PROGRESS_LABEL, length=total) as rows:
-            for i, row in enumerate(rows):
-                if i == 0:
-                    # This is the header row
-                    fields = [cell.value for cell in row]
-                else:
-                    org = dict(zip(fields, [cell.value for cell in row]))
+    loaded = db.meta.get('dataset') or {}
+    if not force and loaded.get('sha256') == digest and analyzer in (None, db.profile):
+        click.echo(' '.join([green(OK), white('Index version {0} already built from this dataset'.format(
+            db.version.name))]))
+        return
+    try:
+        header, rows, total = readers.read(filename, fmt)
+    except ValueError as e:
+        click.echo(' '.join([red(KO), white(str(e))]))
+        sys.exit(1)
+    count = 0
+    start = time.time()
+    dataset = {'source': source, 'sha256': digest, 'size': os.path.getsize(filename)}
+    with db.indexing(memory, incremental=incremental, max_segments=max_segments, analyzer=analyzer,
+                     dataset=dataset) as infos:
+        batches = readers.process(normalize_batch, header, rows, workers, batch_size)
+        length = -(-total // batch_size) if total else None
+        with click.progressbar(batches, label=PROGRESS_LABEL, length=length) as bar:
+            for batch in bar:
+                for org in batch:
                     db.save_organization(org)
-        click.echo(OPTIMIZE_LABEL.format(**infos))
-    click.echo(green(OK) + white(' {0} items loaded with success'.format(i)))
-
-
-def download_with_progress(url):
-    req = Request(url, method='HEAD')
-    req.add_header('Accept-Encoding', 'identity')
-    response = urlopen(req)
-    content_disposition = response.headers.get('Content-Disposition', '')
-    if 'filename' in content_disposition:
-        # Retrieve the filename and remove the last ".
-        filename = content_disposition.split('filename="')[-1][:-1]
-    else:
-        filename = os.path.basename(url).strip()
+                count += len(batch)
+        if infos['optimize']:
+            click.echo(OPTIMIZE_LABEL.format(**infos))
+    duration = time.time() - start
+    click.echo(green(OK) + white(' {0} items loaded with success in {1:.1f}s ({2:.0f} rows/s)'.format(
+        count, duration, count / duration if duration else 0
+    )))
+    if incremental:
+        click.echo(white('{added} added, {updated} updated, {deleted} deleted, {unchanged} unchanged'.format(**infos)))
+    click.echo(white('Published index version {0} ({1} analyzer)'.format(db.version.name, db.profile)))
+
+
+@cli.command()
+@click.option('-m', '--memory', type=int, help="Limit memory usage (in Mb)", default=1024)
+@click.option('-a', '--analyzer', type=click.Choice(list(PROFILES)),
+              help='Organization name analysis profile (the current index one by default)')
+@click.pass_obj
+def migrate(config, memory, analyzer):
+    '''Rewrite an existing index with the current storage layout'''
+    db = DB(config)
+    count = db.migrate(memory, analyzer)
+    click.echo(green(OK) + white(' {0} items migrated with success'.format(count)))
+
+
+@cli.command('export')
+@click.option('-o', '--output', default='-', type=click.Path(writable=True, allow_dash=True),
+              help='Output file, gzipped if ending with .gz')
+@click.option('-f', '--format', 'fmt', type=click.Choice(export.FORMATS), default='ndjson', help='Output format')
+@click.option('-q', '--query', help='Only export organizations matching this query')
+@click.option('-p', '--postal-code', help='Only export organizations with this postal code prefix')
+@click.option('-d', '--department', help='Only export organizations located in this department')
+@click.option('-z', '--gzip', 'compress', is_flag=True, help='Compress the output')
+@click.pass_obj
+def export_command(config, output, fmt, query, postal_code, department, compress):
+    '''Export every organization from the index'''
+    db = DB(config)
+    compress = compress or output.endswith('.gz')
+    stream = export.serialize(db.export(query, postal_code=postal_code, department=department), fmt, gzip=compress)
+    out = click.get_binary_stream('stdout') if output == '-' else open(output, 'wb')
+    try:
+        for chunk in stream:
+            out.write(chunk)
+    finally:
+        if out is not click.get_binary_stream('stdout'):
+            out.close()
 
-    content_length = response.headers.get('Content-Length')
-    if content_length:
-        size = int(content_length)
-    else:
-        size = 1  # Fake for progress bar.
 
-    with click.progressbar(length=size, label=DOWNLOAD_LABEL) as bar:
-        def reporthook(blocknum, blocksize, totalsize):
-            read = blocknum * blocksize
-            if read <= 0:
-                return
-            if read >= totalsize:
-                bar.update(size)
-            else:
-                bar.update(read)
+def download_with_progress(url, directory='.'):
+    '''Download a dataset unless unchanged since the previous download, with a progress bar'''
+    with click.progressbar(length=1, label=DOWNLOAD_LABEL) as bar:
+        def progress(received, total):
+            bar.length = total or received + 1
+            bar.update(received - bar.pos)
 
-        filename, _ = urlretrieve(url, filename, reporthook=reporthook)
-        bar.update(size)
-    click.echo(' '.join([green(OK), white('Downloaded file'), filename]))
-    return filename
+        result = download.download(url, directory, progress=progress)
+        bar.update(bar.length - bar.pos)
+    click.echo(' '.join([green(OK), white('Dataset {0}'.format(result.status)), result.filename]))
+    return result
 
 
 @cli.command()
 @click.option('-d', '--debug', is_flag=True)
 @click.option('--port', default=8888)
+@click.option('--async', 'use_async', is_flag=True,
+              help='Serve with an ASGI server dispatching requests to processes and threads (requires uvicorn)')
+@click.option('-w', '--workers', type=int, help='Number of search processes in async mode (default: CPU count)')
+@click.option('-t', '--threads', type=int, default=DEFAULT_THREADS, help='Number of lookup threads in async mode')
 @click.pass_obj
-def serve(config, debug, port):
+def serve(config, debug, port, use_async, workers, threads):
     '''Launch a development server'''
-    app = Flask(__name__)
-    db = DB(config)
-    app.config.SWAGGER_UI_DOC_EXPANSION = 'list'
-    api.init_app(app)
-    db.init_app(app)
-    app.run(debug=debug, port=port)
+    app = create_app(DB(config))
+    if not use_async:
+        app.run(debug=debug, port=port)
+        return
+    try:
+        import uvicorn
+    except ImportError:
+        click.echo(' '.join([red(KO), white('The async mode requires uvicorn')]))
+        sys.exit(1)
+    application = Application(app, workers=workers, threads=threads)
+    uvicorn.run(application, port=port, log_level='debug' if debug else 'info')
+
+
+def human_size(size):
+    for unit in ('b', 'Kb', 'Mb'):
+        if size < 1024:
+            return '{0:.0f}{1}'.format(size, unit) if unit == 'b' else '{0:.1f}{1}'.format(size, unit)
+        size /= 1024
+    return '{0:.1f}Gb'.format(size)
 
 
 @cli.command()
+@click.option('-j', '--json', 'as_json', is_flag=True, help='Output the index statistics as JSON')
 @click.pass_obj
-def info(config):
+def info(config, as_json):
     '''Display configuration and data statistics'''
+    stats = DB(config).index_stats()
+    if as_json:
+        output_results(stats, click.get_text_stream('stdout'))
+        return
     click.echo(cyan('OFSearch configuration'))
     for key, value in config.items():
         click.echo('{0}: {1}'.format(white(key), value))
+    click.echo(cyan('Index'))
+    for key in ('path', 'version', 'generation', 'profile', 'documents', 'deleted'):
+        click.echo('{0}: {1}'.format(white(key), stats[key]))
+    dataset = stats['meta'].get('dataset')
+    if dataset:
+        click.echo('{0}: {1} ({2}, sha256 {3})'.format(
+            white('dataset'), dataset.get('source'), human_size(dataset.get('size') or 0), dataset.get('sha256')))
+    click.echo('{0}: {1} (stored fields {2})'.format(
+        white('size'), human_size(stats['bytes']['index']), human_size(stats['bytes']['stored'])))
+    click.echo(cyan('Segments'))
+    for segment in stats['segments']:
+        files = ', '.join('{0} {1}'.format(kind, human_size(size)) for kind, size in sorted(segment['files'].items()))
+        click.echo('{0}: {1} documents, {2} deleted ({3})'.format(
+            white(segment['id']), segment['documents'], segment['deleted'], files))
+    click.echo(cyan('Fields'))
+    for name, field in stats['fields'].items():
+        click.echo('{0}: {1} terms, {2} tokens'.format(white(name), field['terms'], field['tokens']))
+    click.echo(cyan('Side stores'))
+    for name, size in stats['bytes']['stores'].items():
+        click.echo('{0}: {1}'.format(white(name), human_size(size)))
+
+
+@cli.command()
+@click.argument('query')
+@click.option('-l', '--limit', type=int, default=20, help='Max number of results')
+@click.option('-s', '--sort', type=click.Choice(SORTS), help='Sort by decreasing value instead of relevance')
+@click.option('--fuzzy', is_flag=True, help='Correct misspelled words before searching')
+@click.option('--cold', is_flag=True, help='Profile the first search, opening the index and side stores')
+@click.option('-t', '--top', type=int, default=profiling.DEFAULT_TOP, help='Number of functions and allocations listed')
+@click.option('--sort-by', default='cumulative', type=click.Choice(('cumulative', 'tottime', 'ncalls')),
+              help='Functions ordering')
+@click.pass_obj
+def profile(config, query, limit, sort, fuzzy, cold, top, sort_by):
+    '''Profile a search: stages timings, memory allocations and functions costs'''
+    result = profiling.profile_query(config, query, warm=not cold, top=top, limit=limit, sort=sort, fuzzy=fuzzy)
+    click.echo('{0}: {1} results out of {2}{3} ({4}) in {5:.1f}ms'.format(
+        white(query), result.results, result.total, ' (partial)' if result.partial else '',
+        human_size(result.bytes), result.duration * 1000))
+    click.echo(cyan('Stages'))
+    for stage, duration in result.stages.items():
+        click.echo('{0}: {1:.2f}ms'.format(white(stage), duration * 1000))
+    click.echo(cyan('Memory'))
+    click.echo('{0}: {1}, {2}: {3}'.format(
+        white('allocated'), human_size(result.memory.current), white('peak'), human_size(result.memory.peak)))
+    for allocation in result.allocations:
+        click.echo('{0}: {1} in {2} blocks'.format(white(allocation.where), human_size(allocation.size),
+                                                   allocation.count))
+    click.echo(cyan('Functions'))
+    stats = pstats.Stats(result.profiler, stream=click.get_text_stream('stdout'))
+    stats.strip_dirs().sort_stats(sort_by).print_stats(top)
 
 
 @cli.command()
@@ -221,6 +376,89 @@ def shell(config):
     embed()
 
 
+@cli.group()
+def bench():
+    '''Run benchmarks and output their results as JSON'''
+    pass
+
+
+def output_results(results, output):
+    json.dump(results, output, indent=2)
+    output.write('\n')
+
+
+@bench.command('specialties')
+@click.option('-n', '--count', type=int, default=10000, help='Number of generated organizations')
+@click.option('-o', '--output', type=click.File('w'), default='-', help='Results output file')
+def bench_specialties(count, output):
+    '''Compare specialties storage layouts'''
+    output_results(benchmarks.bench_specialties(count), output)
+
+
+@bench.command('queries')
+@click.option('-l', '--log', type=click.Path(exists=True), help='A JSON lines query log to replay')
+@click.option('-n', '--count', type=int, default=1000, help='Number of synthetic requests without log')
+@click.option('-c', '--concurrency', type=int, default=1, help='Number of concurrent clients')
+@click.option('-o', '--output', type=click.File('w'), default='-', help='Results output file')
+@click.pass_obj
+def bench_queries(config, log, count, concurrency, output):
+    '''Measure the API throughput and latency on the current index'''
+    output_results(benchmarks.bench_queries(config, log, count, concurrency), output)
+
+
+@bench.command('load')
+@click.option('-n', '--count', type=int, default=10000, help='Number of generated organizations')
+@click.option('-m', '--memory', type=int, help="Limit memory usage (in Mb)", default=1024)
+@click.option('-w', '--workers', type=int, default=0, help='Number of processes normalizing rows')
+@click.option('-o', '--output', type=click.File('w'), default='-', help='Results output file')
+def bench_load(count, memory, workers, output):
+    '''Measure the load time, index size and peak memory on a generated dataset'''
+    output_results(benchmarks.bench_load(count, memory, workers), output)
+
+
+@bench.command('analyzers')
+@click.option('-n', '--count', type=int, default=10000, help='Number of generated organizations')
+@click.option('-q', '--queries', type=int, default=300, help='Number of generated queries')
+@click.option('-m', '--memory', type=int, help="Limit memory usage (in Mb)", default=1024)
+@click.option('-o', '--output', type=click.File('w'), default='-', help='Results output file')
+def bench_analyzers(count, queries, memory, output):
+    '''Compare the index size, load time and query latency of the analyzer profiles'''
+    output_results(benchmarks.bench_analyzers(count, queries, memory), output)
+
+
+@bench.command('serializer')
+@click.option('-l', '--limit', type=int, default=100, help='Number of results per page')
+@click.option('-o', '--output', type=click.File('w'), default='-', help='Results output file')
+@click.pass_obj
+def bench_serializer(config, limit, output):
+    '''Check pre-serialized organizations against the API output and compare their cost'''
+    results = benchmarks.bench_serializer(config, limit)
+    output_results(results, output)
+    if results['mismatches']:
+        sys.exit(1)
+
+
+@bench.command('fuzzy')
+@click.option('-q', '--queries', type=int, default=300, help='Number of misspelled queries')
+@click.option('-l', '--limit', type=int, default=20, help='Number of results per query')
+@click.option('-o', '--output', type=click.File('w'), default='-', help='Results output file')
+@click.pass_obj
+def bench_fuzzy(config, queries, limit, output):
+    '''Compare the recall and latency of plain and fuzzy searches on misspelled names'''
+    output_results(benchmarks.bench_fuzzy(config, queries, limit), output)
+
+
+@bench.command('serving')
+@click.option('-n', '--count', type=int, default=2000, help='Number of synthetic requests')
+@click.option('-c', '--concurrency', type=int, default=16, help='Number of concurrent clients')
+@click.option('-w', '--workers', type=int, help='Number of workers or search processes (default: CPU count)')
+@click.option('-o', '--output', type=click.File('w'), default='-', help='Results output file')
+@click.pass_obj
+def bench_serving(config, count, concurrency, workers, output):
+    '''Compare the gunicorn gevent and the async servers throughput on the current index'''
+    output_results(benchmarks.bench_serving(config, count, concurrency, workers), output)
+
+
 def main():
     '''
     Start the cli interface.
@@ -0,0 +1,94 @@
+'''
+Columnar numeric side store.
+
+Numeric attributes are stored as one memory-mapped NumPy array per attribute,
+indexed by document number, so they can be filtered and sorted with vectorized operations.
+'''
+import os
+
+import numpy as np
+
+from .bitsets import Bitset
+
+COLUMNS = ('form_total', 'trainees', 'hours')
+DTYPE = np.int64
+
+
+def org_values(org):
+    '''Extract the numeric columns values from an organization, missing values are 0'''
+    specialties = org.get('specialties') or []
+    return {
+        'form_total': org.get('form_total') or 0,
+        'trainees': sum(s['trainees'] or 0 for s in specialties),
+        'hours': sum(s['hours'] or 0 for s in specialties),
+    }
+
+
+class ColumnsWriter(object):
+    '''Build and write the numeric columns of `size` documents'''
+    def __init__(self, path, size):
+        self.path = path
+        self._arrays = dict((name, np.zeros(size, dtype=DTYPE)) for name in COLUMNS)
+
+    def add(self, docnum, values):
+        for name, value in values.items():
+            self._arrays[name][docnum] = value
+
+    def close(self):
+        for name, array in self._arrays.items():
+            filename = os.path.join(self.path, name + '.npy')
+            tmp = filename + '.tmp.npy'
+            np.save(tmp, array)
+            os.replace(tmp, filename)
+
+
+def read_columns(path):
+    '''Memory-map the numeric columns, `None` if they are missing'''
+    columns = {}
+    for name in COLUMNS:
+        filename = os.path.join(path, name + '.npy')
+        if not os.path.exists(filename):
+            return None
+        columns[name] = np.load(filename, mmap_mode='r')
+    return columns
+
+
+def to_bitset(mask):
+    '''Convert a boolean mask indexed by document number into a bitset'''
+    return Bitset.from_bytes(np.packbits(mask, bitorder='little').tobytes())
+
+
+def to_mask(bitset, size):
+    '''Convert a bitset into a boolean mask of `size` documents'''
+    data = np.frombuffer(bitset.to_bytes(), dtype=np.uint8)
+    bits = np.unpackbits(data, bitorder='little').astype(bool)
+    if len(bits) < size:
+        bits = np.concatenate((bits, np.zeros(size - len(bits), dtype=bool)))
+    return bits[:size]
+
+
+def minimums(columns, **minimums):
+    '''A bitset of documents whose columns values are at least the given minimums'''
+    mask = None
+    for name, minimum in minimums.items():
+        if minimum is None:
+            continue
+        column_mask = columns[name] >= minimum
+        mask = column_mask if mask is None else mask & column_mask
+    return None if mask is None else to_bitset(mask)
+
+
+def top(columns, name, docnums, count):
+    '''
+    The `count` documents among `docnums` with the highest `name` column values,
+    sorted by decreasing value then by document number.
+    '''
+    values = columns[name][docnums]
+    if count < len(docnums):
+        # Keep every document tied with the last one so that the lowest document numbers win
+        threshold = values[np.argpartition(-values, count - 1)[count - 1]]
+        selected = np.flatnonzero(values >= threshold)
+    else:
+        selected = np.arange(len(docnums))
+    order = np.lexsort((docnums[selected], -values[selected]))
+    return docnums[selected[order[:count]]]
@@ -1,21 +1,95 @@
+import base64
 import csv
+import gc
+import hashlib
+import itertools
+import json
 import logging
 import multiprocessing
 import os
 import pkg_resources
+import shutil
+import struct
+import threading
+import time
+import zlib
 
 from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
 
 from whoosh import fields, index
 from whoosh.analysis import NgramWordAnalyzer
-from whoosh.qparser import MultifieldParser
+from whoosh.collectors import FilterCollector, TopCollector, WrappingCollector
+from whoosh.matching import WrappingMatcher
+from whoosh.qparser import BoostPlugin, EveryPlugin, MultifieldParser, PhrasePlugin, RangePlugin, WildcardPlugin
+from whoosh.query import And, Every, Or, Prefix
+from whoosh.reading import TermNotFound
+
+from . import columns, geo, serializer, spelling
+from .analysis import DEFAULT_PROFILE, NAME_FIELD, PREFIX_FIELD, name_fields
+from .bitsets import Bitset, BitsetsWriter, intersection, read_bitsets
+from .cache import LRUCache, DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL
+from .identifiers import IdentifierTable, TableWriter
+from .metrics import Metrics, DEFAULT_SLOW_QUERY
+from .suggest import Suggester, SuggestWriter
+from .utils import ObjectDict, directory_size, memory_usage
 
 log = logging.getLogger(__name__)
 
 
 DEFAULT_INDEX = 'index'
-DEFAULT_MAX_MEMORY = '1024'
+DEFAULT_MAX_MEMORY = 1024
+DEFAULT_POOL_SIZE = 4
+DEFAULT_REFRESH_INTERVAL = 1  # in seconds
+DEFAULT_MAX_SEGMENTS = 10
+DEFAULT_GRACE_PERIOD = 300  # in seconds
+WARM_CHUNK_SIZE = 1024 * 1024
+VERSIONS_DIR = 'versions'
+CURRENT_LINK = 'current'
+RETIRED_FILE = 'retired'
+FINGERPRINTS_FILE = 'fingerprints.json'
+META_FILE = 'meta.json'
+STORES_DIR = 'stores'
+IDENTIFIERS_FILE = 'identifiers.idx'
+SPECIALTIES_FILE = 'specialties.bits'
+SUGGEST_FILE = 'suggest.json.gz'
+GEO_FILE = 'geo.bits'
 MAX_SPECIALTIES = 15
+SPECIALTIES_KEYS = [
+    ('sf{0}'.format(i), 'nsf{0}'.format(i), 'nhsf{0}'.format(i)) for i in range(1, MAX_SPECIALTIES + 1)
+]
+LEGACY_SPECIALTIES_FIELDS = ('sf*', 'nsf*', 'nhsf*')
+# A packed specialty: code, trainees and hours
+SPECIALTY = struct.Struct('<Hii')
+MISSING = -1
+# A search cursor: last score or sort value, last document number and a checksum of the index and sort
+CURSOR = struct.Struct('<dII')
+COUNTS = ('exact', 'estimate', 'capped')
+COUNT_CAP = 10000
+# Whoosh segment files suffixes
+SEGMENT_FILES = {
+    '.trm': 'terms',
+    '.pst': 'postings',
+    '._stored.col': 'stored',
+    '.seg': 'compound',
+    '.dels': 'deletions',
+}
+DEFAULT_TIME_LIMIT = 1000  # in milliseconds
+# Number of matcher steps or documents between two clock reads
+DEADLINE_CHECK = 32
+QUERY_SYNTAXES = ('restricted', 'full')
+DEFAULT_QUERY_SYNTAX = 'restricted'
+# Query syntax plugins disabled in restricted mode: they can match or score most of the index
+EXPENSIVE_PLUGINS = (WildcardPlugin, RangePlugin, EveryPlugin, BoostPlugin, PhrasePlugin)
+
+
+def siret(org):
+    '''Build the SIRET from the SIREN and the establishment number'''
+    siren, etab = org.get('da_siren'), org.get('da_no_etab')
+    if siren and etab:
+        return '{0}{1}'.format(siren, etab)
 
 
 def parse_boolean(value):
@@ -36,6 +110,46 @@ def parse_int(value):
         return None
 
 
+def pack_specialties(specialties):
+    '''
+    Pack `(code, trainees, hours)` triples into a fixed-width binary array.
+
+    The array is base64 encoded because Whoosh pickles stored fields
+    with protocol 2 which serializes bytes very inefficiently.
+    '''
+    data = b''.join(
+        SPECIALTY.pack(code, MISSING if trainees is None else trainees, MISSING if hours is None else hours)
+        for code, trainees, hours in specialties
+    )
+    return base64.b64encode(data).decode('ascii')
+
+
+def unpack_specialties(data):
+    '''Decode a packed specialties array'''
+    return [{
+        'code': code,
+        'trainees': None if trainees == MISSING else trainees,
+        'hours': None if hours == MISSING else hours,
+    } for code, trainees, hours in SPECIALTY.iter_unpack(base64.b64decode(data))]
+
+
+def legacy_specialties(doc):
+    '''Extract specialties from the `sf*`, `nsf*` and `nhsf*` fields of an index built before packing'''
+    specialties = []
+    for sf_key, nsf_key, nhsf_key in SPECIALTIES_KEYS:
+        sf = doc.pop(sf_key, None)
+        nsf = doc.pop(nsf_key, None)
+        nhsf = doc.pop(nhsf_key, None)
+        if not sf:
+            continue
+        specialties.append({
+            'code': sf,
+            'trainees': nsf,
+            'hours': nhsf,
+        })
+    return specialties
+
+
 ngram_analyzer = NgramWordAnalyzer(minsize=3)
 
 
@@ -66,15 +180,300 @@ class Organization(fields.SchemaClass):
     adr_code_postal_postale = fields.ID(stored=True)
     # adr_ville_postale : Ville de l'adresse postale
     adr_ville_postale = fields.TEXT(stored=True)
+    # specialties : packed (sf, nsf, nhsf) triples
+    # sf : Spécialité de Formation
+    # nsf : Nombre de stagiaires formés dans la spécialité
+    # nhsf : Nombre d'heures-stagiaires suivies dans la spécialité
+    specialties = fields.STORED()
 
 
 schema = Organization()
-# sf : Spécialité de Formation
-schema.add('sf*', fields.NUMERIC(stored=True), glob=True)
-# nsf : Nombre de stagiaires formés dans la spécialité
-schema.add('nsf*', fields.NUMERIC(stored=True), glob=True)
-# nhsf : Nombre d'heures-stagiaires suivies dans la spécialité
-schema.add('nhsf*', fields.NUMERIC(stored=True), glob=True)
+
+
+def make_schema(profile=DEFAULT_PROFILE):
+    '''The organizations schema with the name analyzed according to an analysis profile'''
+    custom = Organization()
+    custom.remove(NAME_FIELD)
+    for name, field in name_fields(profile).items():
+        custom.add(name, field)
+    return custom
+
+
+# The organization fields, in the official dataset order
+FIELDS = (
+    'numero_de_da', 'form_total', 'da_siren', 'da_no_etab', 'da_raison_sociale',
+    'adr_rue_physique', 'adr_rue_complement_physique', 'adr_code_postal_physique', 'adr_ville_physique',
+    'adr_rue_postale', 'adr_rue_complement_postale', 'adr_code_postal_postale', 'adr_ville_postale',
+)
+# The official dataset columns
+DATASET_HEADER = FIELDS + tuple(key for keys in SPECIALTIES_KEYS for key in keys)
+POSTAL_CODE_FIELDS = ('adr_code_postal_physique', 'adr_code_postal_postale')
+
+
+def normalize(org):
+    '''Turn a raw dataset row into indexable fields'''
+    doc = dict((k, v) for k, v in org.items() if k in schema and v is not None and v != '')
+    doc['form_total'] = parse_int(doc.get('form_total'))
+    specialties = []
+    for sf_key, nsf_key, nhsf_key in SPECIALTIES_KEYS:
+        sf = parse_int(org.get(sf_key))
+        if sf:
+            specialties.append((sf, parse_int(org.get(nsf_key)), parse_int(org.get(nhsf_key))))
+    doc['specialties'] = pack_specialties(specialties)
+    for key, value in doc.items():
+        # Identifiers may be typed as numbers depending on the dataset format
+        if isinstance(value, (int, float)) and not isinstance(schema[key], fields.NUMERIC):
+            doc[key] = str(value)
+    return doc
+
+
+def org_to_row(org):
+    '''Flatten an organization back into a raw dataset row'''
+    row = dict((k, v) for k, v in org.items() if k != 'specialties')
+    for keys, specialty in zip(SPECIALTIES_KEYS, org.get('specialties') or []):
+        for key, attr in zip(keys, ('code', 'trainees', 'hours')):
+            row[key] = specialty[attr]
+    return row
+
+
+def fingerprint(doc):
+    '''A stable hash of a normalized organization'''
+    data = json.dumps(doc, sort_keys=True, separators=(',', ':')).encode('utf8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def encode_cursor(value, docnum, tag):
+    '''An opaque cursor continuing a search after the given score or sort value and document'''
+    data = CURSOR.pack(value, docnum, zlib.crc32(repr(tag).encode('utf8')))
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, tag):
+    '''
+    Decode a cursor into a `(value, docnum)` tuple.
+
+    Raise a `ValueError` if the cursor is malformed or has been built for another index or sort.
+    '''
+    try:
+        value, docnum, checksum = CURSOR.unpack(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError, struct.error):
+        raise ValueError('Malformed cursor')
+    if checksum != zlib.crc32(repr(tag).encode('utf8')):
+        raise ValueError('Expired cursor')
+    return value, docnum
+
+
+class CursorCollector(TopCollector):
+    '''A top collector only keeping documents ranked after a given `(score, docnum)`'''
+    def __init__(self, after, limit=10, **kwargs):
+        TopCollector.__init__(self, limit=limit, **kwargs)
+        self.after = after
+
+    def _collect(self, global_docnum, score):
+        after_score, after_docnum = self.after
+        if score > after_score or (score == after_score and global_docnum <= after_docnum):
+            self.total += 1
+            return 0
+        return TopCollector._collect(self, global_docnum, score)
+
+
+def segment_files(storage, segment):
+    '''The size of the files of an index segment by kind (in bytes)'''
+    segid = segment.segment_id()
+    compound = segment.open_compound_file(storage) if segment.is_compound() else None
+    files = {}
+    try:
+        for name in (compound or storage).list():
+            if not name.startswith((segid + '.', segid + '_')):
+                continue
+            suffix = name[len(segid):]
+            kind = 'lengths' if suffix.endswith('_len.col') else SEGMENT_FILES.get(suffix, suffix.lstrip('._'))
+            files[kind] = files.get(kind, 0) + (compound or storage).file_length(name)
+    finally:
+        if compound is not None:
+            compound.close()
+    return files
+
+
+class Deadline(object):
+    '''A time budget in seconds from now, unlimited if `None` or 0'''
+    def __init__(self, budget=None):
+        self.at = time.monotonic() + budget if budget else None
+        self.reached = False
+        self._countdown = DEADLINE_CHECK
+
+    def expired(self):
+        '''Whether the deadline is reached, the clock being read once every `DEADLINE_CHECK` calls'''
+        if self.reached or self.at is None:
+            return self.reached
+        self._countdown -= 1
+        if self._countdown <= 0:
+            self._countdown = DEADLINE_CHECK
+            self.reached = time.monotonic() > self.at
+        return self.reached
+
+    def iterate(self, docnums):
+        '''Iterate over document numbers until the deadline is reached'''
+        for docnum in docnums:
+            if self.expired():
+                return
+            yield docnum
+
+    def docs_for_query(self, searcher, q):
+        '''
+        Iterate over the document numbers matching a query until the deadline is reached.
+
+        Matchers are stepped through instead of using Whoosh `all_ids`,
+        which reads both sides of an intersection whole before yielding anything.
+        '''
+        for subsearcher, offset in searcher.leaf_searchers():
+            try:
+                matcher = DeadlineMatcher(q.matcher(subsearcher, subsearcher.boolean_context()), self)
+            except TermNotFound:
+                continue
+            while matcher.is_active():
+                yield offset + matcher.id()
+                matcher.next()
+
+
+class DeadlineMatcher(WrappingMatcher):
+    '''A matcher becoming inactive once a deadline is reached, even between two matches'''
+    def __init__(self, child, deadline, boost=1.0):
+        WrappingMatcher.__init__(self, child, boost=boost)
+        self.deadline = deadline
+
+    def _replacement(self, newchild):
+        return self.__class__(newchild, self.deadline, boost=self.boost)
+
+    def copy(self):
+        return self.__class__(self.child.copy(), self.deadline, boost=self.boost)
+
+    def is_active(self):
+        return not self.deadline.expired() and self.child.is_active()
+
+    def next(self):
+        # Scored collectors rely on the returned quality flag
+        return self.child.next()
+
+    def skip_to_quality(self, minquality):
+        if self.deadline.expired():
+            return 0
+        return self.child.skip_to_quality(minquality / self.boost)
+
+    def all_ids(self):
+        return self.deadline.iterate(self.child.all_ids())
+
+
+class DeadlineCollector(WrappingCollector):
+    '''
+    Stop collecting once a deadline is reached, keeping the documents collected so far.
+
+    Unlike Whoosh `TimeLimitCollector` it does not need timer threads nor signals
+    which do not play well with gevent: the child matcher is wrapped into a `DeadlineMatcher`
+    so the clock is also checked while skipping over low quality blocks.
+    '''
+    def __init__(self, child, deadline):
+        WrappingCollector.__init__(self, child)
+        self.deadline = deadline
+
+    def set_subsearcher(self, subsearcher, offset):
+        WrappingCollector.set_subsearcher(self, subsearcher, offset)
+        self.child.matcher = self.matcher = DeadlineMatcher(self.child.matcher, self.deadline)
+
+    def collect_matches(self):
+        if not self.deadline.expired():
+            self.child.collect_matches()
+
+    def computes_count(self):
+        # A wrapping `FilterCollector` would otherwise use the unfiltered count of the child
+        return self.child.computes_count()
+
+
+def normalize_batch(header, rows):
+    '''Normalize a batch of raw rows given the dataset header'''
+    return [normalize(dict(zip(header, row))) for row in rows]
+
+
+class SearcherPool(object):
+    '''
+    A small pool of long-lived searchers shared across requests.
+
+    Searchers are only refreshed when the index generation on disk changes,
+    which is checked at most once per `interval` seconds.
+    '''
+    def __init__(self, index, size=DEFAULT_POOL_SIZE, interval=DEFAULT_REFRESH_INTERVAL):
+        self.index = index
+        self.size = size
+        self.interval = interval
+        self.generation = index.latest_generation()
+        self._checked_at = time.monotonic()
+        self.retired = False
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def check(self):
+        '''Return the current index generation, reading it from disk if the interval expired'''
+        now = time.monotonic()
+        if now - self._checked_at >= self.interval:
+            self._checked_at = now
+            self.generation = self.index.latest_generation()
+        return self.generation
+
+    @contextmanager
+    def searcher(self):
+        '''Borrow a searcher up to date with the current index generation'''
+        generation = self.check()
+        with self._lock:
+            searcher = self._idle.pop() if self._idle else None
+        if searcher is None:
+            searcher = self.index.searcher()
+        elif searcher.reader().generation() != generation:
+            searcher = searcher.refresh()
+        try:
+            yield searcher
+        finally:
+            self.release(searcher)
+
+    def release(self, searcher):
+        '''Give back a searcher to the pool or close it if not reusable'''
+        with self._lock:
+            reusable = not self.retired and searcher.reader().generation() >= self.generation
+            if reusable and len(self._idle) < self.size:
+                self._idle.append(searcher)
+                return
+        searcher.close()
+
+    def close(self):
+        '''Close all idle searchers'''
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for searcher in idle:
+            searcher.close()
+
+    def retire(self):
+        '''Close idle searchers and the borrowed ones once released'''
+        self.retired = True
+        self.close()
+
+
+class Version(object):
+    '''
+    An index version with its own searchers pool and side stores.
+
+    The unversioned index of a previous ofsearch release is served as a version named `None`.
+    '''
+    def __init__(self, name, path, size=DEFAULT_POOL_SIZE, interval=DEFAULT_REFRESH_INTERVAL):
+        self.name = name
+        self.path = path
+        self.index = index.open_dir(path)
+        self.pool = SearcherPool(self.index, size=size, interval=interval)
+        self.stores = None
+        filename = os.path.join(path, META_FILE)
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {}
 
 
 class DB(object):
@@ -88,82 +487,776 @@ class DB(object):
         self.schema = schema
         if not os.path.exists(config.index):
             os.mkdir(config.index)
-        if index.exists_in(config.index):
-            self.index = index.open_dir(config.index)
-        else:
-            self.index = index.create_in(config.index, self.schema)
+        name = self.published()
+        if name is None and not index.exists_in(config.index):
+            name = self.create_version()
+            self.publish(name)
+        self._checked_at = time.monotonic()
+        self._version = self.open_version(name)
         self._specialties = None
+        self.reset()
+
+    def reset(self):
+        '''Create the per-process state: lock, caches and metrics'''
+        config = self.config
+        self._lock = threading.Lock()
+        cache_size = DEFAULT_CACHE_SIZE if config.cache_size is None else config.cache_size
+        cache_ttl = DEFAULT_CACHE_TTL if config.cache_ttl is None else config.cache_ttl
+        # Parsed queries
+        self.queries = LRUCache(cache_size, cache_ttl)
+        # Finished search result pages, filled by the API
+        self.pages = LRUCache(cache_size, cache_ttl)
+        slow_query = DEFAULT_SLOW_QUERY if config.slow_query is None else config.slow_query
+        self.metrics = Metrics(slow_query)
+        time_limit = DEFAULT_TIME_LIMIT if config.time_limit is None else config.time_limit
+        self.time_limit = time_limit / 1000 if time_limit else None
+
+    def preload(self):
+        '''
+        Load the read-only data once before forking workers sharing it copy-on-write.
+
+        Index files are read into the OS cache, the side stores are opened (mostly memory-mapped)
+        and the loaded objects are left out of the garbage collection when supported
+        so the workers do not write into their memory pages.
+        '''
+        self.specialties
+        self.stores
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                with open(os.path.join(root, name), 'rb') as f:
+                    while f.read(WARM_CHUNK_SIZE):
+                        pass
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    def after_fork(self):
+        '''
+        Reset the per-process state of a DB preloaded before forking.
+
+        It should be called once the worker is ready (ie. patched by gevent)
+        so that locks and searchers are not shared with the master process.
+        '''
+        version = self._version
+        version.pool = SearcherPool(version.index, size=version.pool.size)
+        self.reset()
+
+    @property
+    def version(self):
+        '''The index version currently served, switching to the published one if it changed'''
+        now = time.monotonic()
+        if now - self._checked_at >= DEFAULT_REFRESH_INTERVAL:
+            self._checked_at = now
+            name = self.published()
+            if name is not None and name != self._version.name:
+                self.switch(name)
+        return self._version
+
+    @property
+    def index(self):
+        return self.version.index
+
+    @property
+    def pool(self):
+        return self.version.pool
+
+    @property
+    def path(self):
+        '''The directory of the index version currently served'''
+        return self.version.path
+
+    @property
+    def generation(self):
+        '''The index generation currently served'''
+        return self.pool.check()
+
+    @property
+    def tag(self):
+        '''Identify the served index content, generations restarting with each version'''
+        version = self.version
+        return (version.name, version.pool.check())
+
+    def version_path(self, name):
+        if name is None:
+            return self.config.index
+        return os.path.join(self.config.index, VERSIONS_DIR, name)
+
+    def published(self):
+        '''The name of the published index version, `None` for an unversioned index'''
+        try:
+            return os.path.basename(os.readlink(os.path.join(self.config.index, CURRENT_LINK)))
+        except FileNotFoundError:
+            return None
+
+    def open_version(self, name):
+        return Version(name, self.version_path(name), size=self.config.searchers or DEFAULT_POOL_SIZE)
+
+    def switch(self, name):
+        '''
+        Serve another index version.
+
+        Requests in flight keep using the searchers they borrowed from the previous version,
+        which are closed when released.
+        '''
+        with self._lock:
+            previous = self._version
+            if previous.name == name:
+                return
+            try:
+                self._version = self.open_version(name)
+            except (OSError, index.EmptyIndexError):
+                log.exception('Unable to open index version %s', name)
+                return
+        previous.pool.retire()
+        log.info('Switched from index version %s to %s', previous.name, name)
+
+    def create_version(self, copy=False, profile=DEFAULT_PROFILE):
+        '''
+        Create a staging index version and return its name.
+
+        The staging version is empty, with the organization name analyzed according to `profile`,
+        unless `copy` is given, in which case it starts as a hard-linked copy of the published version:
+        Whoosh never modifies the files it has written.
+        '''
+        name = '{0:%Y%m%d%H%M%S%f}-{1}'.format(datetime.now(), os.getpid())
+        path = self.version_path(name)
+        if copy:
+            ignore = shutil.ignore_patterns(VERSIONS_DIR, CURRENT_LINK, STORES_DIR, RETIRED_FILE)
+            shutil.copytree(self.path, path, ignore=ignore, copy_function=os.link)
+        else:
+            os.makedirs(path)
+            index.create_in(path, make_schema(profile))
+        return name
+
+    def publish(self, name):
+        '''Atomically make a staging version the published one and retire the previous one'''
+        previous = self.published()
+        link = os.path.join(self.config.index, CURRENT_LINK)
+        tmp = '{0}.{1}'.format(link, os.getpid())
+        os.symlink(os.path.join(VERSIONS_DIR, name), tmp)
+        os.replace(tmp, link)
+        if previous is not None or index.exists_in(self.config.index):
+            open(os.path.join(self.version_path(previous), RETIRED_FILE), 'w').close()
+        log.info('Published index version %s', name)
+
+    def collect(self, grace=DEFAULT_GRACE_PERIOD):
+        '''
+        Remove the versions retired for more than `grace` seconds.
+
+        Staging versions older than the published one and left untouched
+        for more than `grace` seconds have been abandoned and are removed too.
+        '''
+        current = self.published()
+        root = os.path.join(self.config.index, VERSIONS_DIR)
+        now = time.time()
+        removed = []
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            retired = os.path.join(path, RETIRED_FILE)
+            if name == current:
+                continue
+            elif os.path.exists(retired):
+                expired = now - os.path.getmtime(retired) >= grace
+            else:
+                expired = current is not None and name < current and now - os.path.getmtime(path) >= grace
+            if expired:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(name)
+        # An unversioned index replaced by a published version
+        retired = os.path.join(self.config.index, RETIRED_FILE)
+        if os.path.exists(retired) and now - os.path.getmtime(retired) >= grace:
+            for filename in os.listdir(self.config.index):
+                path = os.path.join(self.config.index, filename)
+                if filename == STORES_DIR:
+                    shutil.rmtree(path, ignore_errors=True)
+                elif filename.startswith(('MAIN_', '_MAIN_')) or filename == FINGERPRINTS_FILE:
+                    os.remove(path)
+            os.remove(retired)
+            removed.append(None)
+        if removed:
+            log.info('Removed %s retired index versions', len(removed))
+        return removed
+
+    def searcher(self):
+        '''A context manager borrowing a shared searcher'''
+        return self.pool.searcher()
+
+    @property
+    def meta(self):
+        '''The metadata recorded with the served index version'''
+        return self.version.meta
+
+    @property
+    def profile(self):
+        '''The organization name analysis profile of the served index version'''
+        return self.meta.get('analyzer', DEFAULT_PROFILE)
+
+    def save_meta(self, meta, path):
+        filename = os.path.join(path, META_FILE)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(meta, f, indent=2, sort_keys=True)
+        os.replace(filename + '.tmp', filename)
 
     @contextmanager
-    def indexing(self, max_memory=DEFAULT_MAX_MEMORY):
-        nb_cpu = multiprocessing.cpu_count()
-        memory = int(max_memory / nb_cpu)
-        self.writer = self.index.writer(procs=nb_cpu, limitmb=memory, multisegment=True)
-        yield {'cpus': nb_cpu, 'memcpu': memory, 'memory': max_memory}
-        self.writer.commit(optimize=True)
-        self.writer = None
-
-    def save_organization(self, org):
+    def indexing(self, max_memory=DEFAULT_MAX_MEMORY, incremental=False, max_segments=DEFAULT_MAX_SEGMENTS,
+                 analyzer=None, dataset=None):
+        '''
+        Index organizations given to `save_organization`.
+
+        A full indexing replaces the whole index content with a single optimized segment.
+        An incremental indexing only writes organizations added, changed or removed
+        since the previous indexing, given their fingerprints,
+        and only optimizes the index if it has more than `max_segments` segments.
+        The organization name is analyzed according to the `analyzer` profile,
+        the one of the served version by default.
+        The `dataset` details (source, hash...) are recorded in the version metadata.
+
+        Organizations are indexed into a staging version which is published once complete
+        and served by running instances from their next request.
+        '''
+        self.fingerprints = {}
+        self.previous = self.load_fingerprints() if incremental else None
+        if incremental and self.previous is None:
+            log.warning('No fingerprints found for this index, performing a full indexing')
+        profile = analyzer or self.profile
+        if self.previous is not None and profile != self.profile:
+            log.warning('Analyzer changed from %s to %s, performing a full indexing', self.profile, profile)
+            self.previous = None
+        infos = self.infos = {'added': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'analyzer': profile}
+        name = self.create_version(copy=self.previous is not None, profile=profile)
+        path = infos['path'] = self.version_path(name)
+        staging = index.open_dir(path)
+        self.prefix = PREFIX_FIELD in staging.schema
+        if 'specialties' not in staging.schema:
+            self.upgrade_schema(staging)
+        if self.previous is not None:
+            self.writer = staging.writer(limitmb=max_memory)
+            infos.update(cpus=1, memcpu=max_memory, memory=max_memory)
+        else:
+            nb_cpu = multiprocessing.cpu_count()
+            memory = int(max_memory / nb_cpu)
+            self.writer = staging.writer(procs=nb_cpu, limitmb=memory, multisegment=True)
+            infos.update(cpus=nb_cpu, memcpu=memory, memory=max_memory)
+        infos['optimize'] = self.previous is None or len(self.writer.segments) + 1 > max_segments
+        try:
+            yield infos
+            if self.previous is not None:
+                for key in set(self.previous) - set(self.fingerprints):
+                    self.writer.delete_by_term('numero_de_da', key)
+                    infos['deleted'] += 1
+            self.writer.commit(optimize=infos['optimize'])
+        except BaseException:
+            self.writer.cancel()
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        finally:
+            self.writer = None
+        self.save_fingerprints(self.fingerprints, path)
+        meta = dict(self.meta, analyzer=profile)
+        if dataset is not None:
+            meta['dataset'] = dataset
+        self.save_meta(meta, path)
+        self.build_stores(staging, path)
+        self.publish(name)
+        self.switch(name)
+        grace = DEFAULT_GRACE_PERIOD if self.config.grace_period is None else self.config.grace_period
+        self.collect(grace)
+
+    def save_organization(self, fields):
+        '''Index an organization already normalized with `normalize`'''
         if not self.writer:
             log.error('You need to start indexing before saving organizations')
-        fields = dict((k, v) for k, v in org.items() if k in self.schema)
-        fields['form_total'] = parse_int(fields['form_total'])
-        for i in range(1, MAX_SPECIALTIES + 1):
-            sf_key = 'sf{0}'.format(i)
-            nsf_key = 'nsf{0}'.format(i)
-            nhsf_key = 'nhsf{0}'.format(i)
-            sf = parse_int(fields.pop(sf_key, None))
-            nsf = parse_int(fields.pop(nsf_key, None))
-            nhsf = parse_int(fields.pop(nhsf_key, None))
-            if not sf:
-                continue
-            fields[sf_key] = sf
-            fields[nsf_key] = nsf
-            fields[nhsf_key] = nhsf
-        self.writer.add_document(**fields)
+        key = fields.get('numero_de_da')
+        digest = fingerprint(fields)
+        self.fingerprints[key] = digest
+        if self.prefix and fields.get(NAME_FIELD):
+            fields = dict(fields, **{PREFIX_FIELD: fields[NAME_FIELD]})
+        if self.previous is None:
+            self.writer.add_document(**fields)
+        elif key not in self.previous:
+            self.writer.add_document(**fields)
+            self.infos['added'] += 1
+        elif self.previous[key] != digest:
+            # `update_document` would also delete the organizations sharing a unique field (ie. the SIREN)
+            self.writer.delete_by_term('numero_de_da', key)
+            self.writer.add_document(**fields)
+            self.infos['updated'] += 1
+        else:
+            self.infos['unchanged'] += 1
+
+    @property
+    def is_legacy(self):
+        '''Wether the index stores specialties into `sf*`, `nsf*` and `nhsf*` fields'''
+        return 'specialties' not in self.index.schema
+
+    def upgrade_schema(self, ix):
+        '''
+        Replace the legacy specialties fields by the packed one in the index schema.
+
+        Existing documents are left untouched, use `migrate` to rewrite them.
+        '''
+        writer = ix.writer()
+        for name in LEGACY_SPECIALTIES_FIELDS:
+            writer.remove_field(name)
+        writer.add_field('specialties', self.schema['specialties'])
+        writer.commit(merge=False)
+
+    def migrate(self, max_memory=DEFAULT_MAX_MEMORY, analyzer=None):
+        '''Rewrite every indexed organization with packed specialties into a new version'''
+        count = 0
+        with self.index.searcher() as s:
+            with self.indexing(max_memory, analyzer=analyzer):
+                for _, stored in s.reader().iter_docs():
+                    self.save_organization(normalize(org_to_row(self.doc_to_org(stored))))
+                    count += 1
+        return count
+
+    def load_fingerprints(self):
+        '''Load the organizations fingerprints of the served version if any'''
+        filename = os.path.join(self.path, FINGERPRINTS_FILE)
+        if not os.path.exists(filename):
+            return None
+        with open(filename) as f:
+            return json.load(f)
+
+    def save_fingerprints(self, fingerprints, path):
+        filename = os.path.join(path, FINGERPRINTS_FILE)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(fingerprints, f, separators=(',', ':'))
+        os.replace(filename + '.tmp', filename)
+
+    def stores_path(self, generation, path=None):
+        return os.path.join(path or self.path, STORES_DIR, str(generation))
+
+    def build_stores(self, ix=None, path=None):
+        '''
+        Build the side stores for the latest generation of an index version, the served one by default.
+
+        Side stores are read-only lookup structures living next to the index.
+        They are built with a single pass over the stored documents.
+        '''
+        ix = ix or self.index
+        with ix.searcher() as s:
+            reader = s.reader()
+            generation = reader.generation()
+            path = self.stores_path(generation, path)
+            if not os.path.exists(path):
+                os.makedirs(path)
+            identifiers = TableWriter(os.path.join(path, IDENTIFIERS_FILE))
+            specialties = BitsetsWriter(os.path.join(path, SPECIALTIES_FILE))
+            areas = BitsetsWriter(os.path.join(path, GEO_FILE))
+            numbers = columns.ColumnsWriter(path, reader.doc_count_all())
+            suggestions = SuggestWriter(os.path.join(path, SUGGEST_FILE))
+            documents = serializer.DocumentsWriter(path, reader.doc_count_all())
+            names = spelling.SpellingWriter(path)
+            for docnum, stored in reader.iter_docs():
+                org = self.doc_to_org(stored)
+                data = serializer.to_json(org)
+                documents.add(docnum, data)
+                identifiers.add((org['numero_de_da'], org['da_siren'], siret(org)), data)
+                specialties.add(docnum, set(str(s['code']) for s in org['specialties']))
+                areas.add(docnum, geo.org_keys(org, POSTAL_CODE_FIELDS))
+                numbers.add(docnum, columns.org_values(org))
+                suggestions.add(org['numero_de_da'], org.get('da_raison_sociale'), org.get('form_total'))
+                names.add(org.get('da_raison_sociale'))
+            identifiers.close()
+            specialties.close()
+            areas.close()
+            numbers.close()
+            suggestions.close()
+            documents.close()
+            names.close()
+        # Remove stores from previous generations
+        root = os.path.dirname(path)
+        for name in os.listdir(root):
+            if name != str(generation):
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+    def load_stores(self, generation, path=None):
+        '''Open the side stores of a given generation, missing ones are `None`'''
+        path = self.stores_path(generation, path)
+        stores = ObjectDict(generation=generation)
+        filename = os.path.join(path, IDENTIFIERS_FILE)
+        stores.identifiers = IdentifierTable(filename) if os.path.exists(filename) else None
+        filename = os.path.join(path, SPECIALTIES_FILE)
+        stores.specialties = read_bitsets(filename) if os.path.exists(filename) else None
+        stores.columns = columns.read_columns(path)
+        filename = os.path.join(path, SUGGEST_FILE)
+        stores.suggester = Suggester(filename) if os.path.exists(filename) else None
+        stores.documents = serializer.read_documents(path)
+        filename = os.path.join(path, GEO_FILE)
+        stores.geo = geo.GeoIndex(read_bitsets(filename)) if os.path.exists(filename) else None
+        stores.speller = spelling.read_speller(path)
+        if not os.path.exists(path):
+            log.warning('No side stores for index generation %s, run `ofsearch migrate` to build them', generation)
+        return stores
+
+    @property
+    def stores(self):
+        '''The side stores matching the current index version and generation'''
+        version = self.version
+        generation = version.pool.check()
+        stores = version.stores
+        if stores is None or stores.generation != generation:
+            stores = version.stores = self.load_stores(generation, version.path)
+        return stores
 
     def init_app(self, app):
         app.extensions['db'] = self
 
-    def search(self, query, page=1, limit=10):
-        qp = MultifieldParser(self.searched_fields, schema=self.index.schema)
-        q = qp.parse(query)
+    def parse(self, query, schema):
+        '''
+        Parse a query string, reusing a previously parsed query if possible.
 
-        with self.index.searcher() as s:
-            results = s.search_page(q, page, pagelen=limit)
-            return {
+        The `restricted` query syntax (the default) leaves out wildcards, ranges, phrases and boosts.
+        '''
+        tag = self.tag
+        q = self.queries.get(query, tag)
+        if q is None:
+            searched = self.searched_fields + [PREFIX_FIELD] if PREFIX_FIELD in schema else self.searched_fields
+            qp = MultifieldParser(searched, schema=schema)
+            if (self.config.query_syntax or DEFAULT_QUERY_SYNTAX) == 'restricted':
+                for plugin in EXPENSIVE_PLUGINS:
+                    qp.remove_plugin_class(plugin)
+            q = qp.parse(query)
+            self.queries.set(query, q, tag)
+        return q
+
+    def search(self, query, page=1, limit=10, specialties=None, facets=None,
+               sort=None, min_trainers=None, min_hours=None, cursor=None, count='exact', raw=False,
+               postal_code=None, department=None, fuzzy=False):
+        '''
+        Search organizations.
+
+        Results can be restricted to organizations training in all the given `specialties`,
+        having at least `min_trainers` trainers and `min_hours` hours of training
+        and located in a `department` or at a postal code starting with `postal_code`.
+        They are sorted by relevance unless a `sort` column is given.
+        Facet counts can be computed for the given `facets` names.
+        Misspelled name words are corrected before parsing if `fuzzy`, the searched query is then given as `corrected`.
+
+        A `cursor` from a previous result `next_cursor` continues after its last result instead of using `page`,
+        at the same cost whatever the depth.
+        The relevance sorted `total` is either `exact`, `estimate`d (an upper bound) or `capped` to `COUNT_CAP`.
+
+        Matching stops when the `time_limit` is reached, the results are then `partial`:
+        only the documents matched so far are ranked, counted and faceted,
+        the relevance sorted `total` falling back to an `estimate` if not counted in time.
+
+        Results are given as API serialized JSON bytes if `raw`.
+        Raise a `ValueError` if the `page` or the `limit` is out of range.
+        '''
+        if page < 1:
+            raise ValueError('Page should be greater than or equal to 1')
+        if limit < 0:
+            raise ValueError('Limit should be greater than or equal to 0')
+        deadline = Deadline(self.time_limit)
+        stores = self.stores
+        stage = self.metrics.stage
+        tag = (self.tag, sort)
+        after = decode_cursor(cursor, tag) if cursor else None
+        if after is not None:
+            page = 1
+        corrected = None
+        with self.searcher() as s:
+            with stage('parse'):
+                if fuzzy and query and stores.speller is not None:
+                    corrected = stores.speller.correct_query(query)
+                searched = corrected or query
+                q = self.parse(searched, s.schema) if searched else Every()
+            docset = self.filter(stores, specialties=specialties, min_trainers=min_trainers, min_hours=min_hours,
+                                 postal_code=postal_code, department=department)
+            if sort and stores.columns is None:
+                sort = None
+            results, total, last = [], None, None
+            if docset is not None and not docset:
+                # Whoosh ignores empty filters
+                total = 0
+            elif sort and limit > 0:
+                with stage('search'):
+                    docnums = np.fromiter(deadline.docs_for_query(s, q), dtype=np.int64)
+                    if docset is not None:
+                        docnums = docnums[columns.to_mask(docset, s.doc_count_all())[docnums]]
+                    total = len(docnums)
+                    values = stores.columns[sort]
+                    if after is not None:
+                        after_value, after_docnum = after
+                        ranked = values[docnums]
+                        docnums = docnums[(ranked < after_value) | ((ranked == after_value) & (docnums > after_docnum))]
+                    docnums = columns.top(stores.columns, sort, docnums, page * limit)[(page - 1) * limit:]
+                    if len(docnums) == limit:
+                        last = (float(values[docnums[-1]]), int(docnums[-1]))
+                with stage('doc_to_org'):
+                    results = self.results(s, stores, [int(docnum) for docnum in docnums], raw)
+            elif limit > 0:
+                with stage('search'):
+                    if after is not None:
+                        collector = CursorCollector(after, limit=limit)
+                    else:
+                        collector = TopCollector(limit=page * limit)
+                    collector = DeadlineCollector(collector, deadline)
+                    if docset is not None:
+                        collector = FilterCollector(collector, allow=docset)
+                    s.search_with_collector(q, collector)
+                    hits = collector.results()
+                    if deadline.reached:
+                        # The collected matches are not all the matches
+                        count = 'estimate'
+                    total = self.count(s, q, docset, hits, count, deadline)
+                    if total is None:
+                        # Counting every match would defeat the time limit
+                        count = 'estimate'
+                        total = self.count(s, q, docset, hits, count)
+                    start = (page - 1) * limit
+                    if hits.scored_length() == start + limit:
+                        last = (hits.score(start + limit - 1), hits.docnum(start + limit - 1))
+                with stage('doc_to_org'):
+                    results = self.results(s, stores, [hits.docnum(i) for i in range(start, hits.scored_length())], raw)
+            result = {
                 'query': query,
                 'page': page,
                 'limit': limit,
-                'total': len(results),
-                'results': [self.doc_to_org(hit.fields()) for hit in results],
+                'total': total,
+                'count': 'exact' if sort else count,
+                'results': results,
+                'next_cursor': encode_cursor(last[0], last[1], tag) if last else None,
+                'partial': deadline.reached,
             }
+            if fuzzy:
+                result['corrected'] = corrected
+            if facets or total is None:
+                # Counts only, without scoring
+                with stage('facets'):
+                    matching = Bitset.from_docnums(deadline.docs_for_query(s, q)) if total != 0 else Bitset()
+                    if docset is not None:
+                        matching &= docset
+                    if total is None or not deadline.reached:
+                        result['total'] = len(matching)
+                        result['count'] = 'exact'
+                    result['partial'] = deadline.reached
+                    if facets:
+                        result['facets'] = dict((name, self.facet(name, matching)) for name in facets)
+            if deadline.reached:
+                self.metrics.partial_results += 1
+            return result
+
+    def filter(self, stores, specialties=None, min_trainers=None, min_hours=None, postal_code=None, department=None):
+        '''The documents matching all the given criteria as a bitset, `None` without criteria'''
+        bitsets = []
+        if specialties:
+            specialties_bitsets = stores.specialties or {}
+            bitsets.extend(specialties_bitsets.get(str(code), Bitset()) for code in specialties)
+        if min_trainers is not None or min_hours is not None:
+            if stores.columns is None:
+                bitsets.append(Bitset())
+            else:
+                bitsets.append(columns.minimums(stores.columns, form_total=min_trainers, hours=min_hours))
+        if postal_code or department:
+            if stores.geo is None:
+                bitsets.append(Bitset())
+            if postal_code and stores.geo is not None:
+                bitsets.append(stores.geo.postal_code(postal_code))
+            if department and stores.geo is not None:
+                bitsets.append(stores.geo.department(department))
+        return intersection(bitsets) if bitsets else None
+
+    def results(self, searcher, stores, docnums, raw=False):
+        '''Load organizations given their document numbers, as API serialized JSON bytes if `raw`'''
+        if raw and stores.documents is not None:
+            documents = stores.documents
+            return [documents[docnum] for docnum in docnums]
+        orgs = [self.doc_to_org(searcher.stored_fields(docnum)) for docnum in docnums]
+        return [serializer.to_json(org) for org in orgs] if raw else orgs
+
+    def count(self, searcher, q, docset, hits, mode='exact', deadline=None):
+        '''
+        Count the documents matching a query given the counting mode.
+
+        Counting over the matches is stopped by an optional deadline, the count is then `None`.
+        '''
+        if mode == 'estimate':
+            estimate = hits.estimated_length()
+            return min(estimate, len(docset)) if docset is not None else estimate
+        elif mode == 'exact' and hits.has_exact_length():
+            return len(hits)
+        docnums = (deadline or Deadline()).docs_for_query(searcher, q)
+        if docset is not None:
+            docnums = (docnum for docnum in docnums if docnum in docset)
+        if mode == 'capped':
+            docnums = itertools.islice(docnums, COUNT_CAP)
+        total = sum(1 for _ in docnums)
+        return None if deadline is not None and deadline.reached else total
+
+    def export(self, query=None, postal_code=None, department=None):
+        '''
+        Iterate over every organization, optionally matching a query, a postal code prefix and a department.
+
+        Organizations are read one by one from the stored fields with a single searcher.
+        '''
+        stores = self.stores
+        with self.searcher() as s:
+            queries = [self.parse(query, s.schema)] if query else []
+            docset = None
+            if stores.geo is not None:
+                docset = self.filter(stores, postal_code=postal_code, department=department)
+            elif department:
+                # Index built without side stores
+                docset = Bitset()
+            elif postal_code:
+                queries.append(Or([Prefix(field, postal_code) for field in POSTAL_CODE_FIELDS]))
+            if queries:
+                q = queries[0] if len(queries) == 1 else And(queries)
+                docnums = s.docs_for_query(q)
+                if docset is not None:
+                    docnums = (docnum for docnum in docnums if docnum in docset)
+            elif docset is not None:
+                docnums = iter(docset)
+            else:
+                for _, stored in s.reader().iter_docs():
+                    yield self.doc_to_org(stored)
+                return
+            for docnum in docnums:
+                yield self.doc_to_org(s.stored_fields(docnum))
+
+    def facet(self, name, docset):
+        '''Count the documents of `docset` for each value of a facet, most frequent first'''
+        if name == 'specialty':
+            bitsets, labels = self.stores.specialties or {}, self.specialties
+        elif name == 'department':
+            stores = self.stores
+            bitsets, labels = stores.geo.departments if stores.geo else {}, {}
+        else:
+            raise ValueError('Unknown facet {0}'.format(name))
+        counts = []
+        for value, bitset in bitsets.items():
+            count = len(bitset & docset)
+            if count:
+                counts.append({'value': value, 'label': labels.get(value), 'count': count})
+        counts.sort(key=lambda c: (-c['count'], c['value']))
+        return counts
+
+    def suggest(self, prefix, limit=10):
+        '''Suggest organizations whose name has a word starting with `prefix`'''
+        suggester = self.stores.suggester
+        return suggester.suggest(prefix, limit) if suggester else []
 
     def get(self, identifier):
-        with self.index.searcher() as s:
-            for key in ('numero_de_da', 'da_siren'):
-                doc = s.document(**{key: identifier})
-                if doc:
-                    return self.doc_to_org(doc)
+        '''Get an organization given its declaration number, its SIREN or its SIRET'''
+        identifiers = self.stores.identifiers
+        with self.metrics.stage('lookup'):
+            if identifiers is not None:
+                return identifiers.get(identifier)
+            # Index built without side stores
+            with self.searcher() as s:
+                return self.lookup(s, identifier)
+
+    def get_json(self, identifier):
+        '''Get an organization serialized as by the API given any identifier, `None` if not found'''
+        identifiers = self.stores.identifiers
+        with self.metrics.stage('lookup'):
+            if identifiers is not None:
+                return identifiers.raw(identifier)
+            with self.searcher() as s:
+                org = self.lookup(s, identifier)
+        return None if org is None else serializer.to_json(org)
+
+    def get_many(self, identifiers):
+        '''
+        Get several organizations given their identifiers.
+
+        Identifiers are resolved in sorted order within a single searcher
+        and organizations are returned in the request order, `None` for misses.
+        '''
+        table = self.stores.identifiers
+        if table is not None:
+            found = dict((identifier, table.get(identifier)) for identifier in sorted(set(identifiers)))
+        else:
+            with self.searcher() as s:
+                found = dict((identifier, self.lookup(s, identifier)) for identifier in sorted(set(identifiers)))
+        return [found[identifier] for identifier in identifiers]
+
+    def lookup(self, searcher, identifier):
+        '''Find an organization given any identifier using Whoosh term lookups'''
+        for key in ('numero_de_da', 'da_siren'):
+            doc = searcher.document(**{key: identifier})
+            if doc:
+                return self.doc_to_org(doc)
+        if len(identifier) == 14:
+            doc = searcher.document(da_siren=identifier[:9], da_no_etab=identifier[9:])
+            if doc:
+                return self.doc_to_org(doc)
 
     def doc_to_org(self, doc):
-        doc['specialties'] = []
-        for i in range(1, MAX_SPECIALTIES + 1):
-            sf_key = 'sf{0}'.format(i)
-            nsf_key = 'nsf{0}'.format(i)
-            nhsf_key = 'nhsf{0}'.format(i)
-            sf = doc.pop(sf_key, None)
-            nsf = doc.pop(nsf_key, None)
-            nhsf = doc.pop(nhsf_key, None)
-            if not sf:
-                continue
-            doc['specialties'].append({
-                'code': sf,
-                'trainees': nsf,
-                'hours': nhsf,
-            })
+        data = doc.pop('specialties', None)
+        if data is not None:
+            doc['specialties'] = unpack_specialties(data)
+        else:
+            doc['specialties'] = legacy_specialties(doc)
         return doc
 
+    def stats(self):
+        '''Expose the serving statistics'''
+        with self.searcher() as s:
+            segments = len(s.reader().leaf_readers())
+            documents = s.doc_count()
+        return {
+            'pid': os.getpid(),
+            'memory': memory_usage(),
+            'version': self.version.name,
+            'generation': self.generation,
+            'segments': segments,
+            'documents': documents,
+            'caches': {
+                'queries': self.queries.stats(),
+                'pages': self.pages.stats(),
+            },
+        }
+
+    def index_stats(self):
+        '''
+        Describe the served index version: metadata, segments, fields and sizes.
+
+        Fields are given with their number of distinct terms and of indexed tokens.
+        Segments files sizes are given by kind (terms, postings, stored fields...).
+        '''
+        ix = self.index
+        with self.searcher() as s:
+            reader = s.reader()
+            segments = []
+            for leaf, _ in reader.leaf_readers():
+                segment = leaf.segment()
+                segments.append({
+                    'id': segment.segment_id(),
+                    'documents': segment.doc_count(),
+                    'deleted': segment.deleted_count(),
+                    'files': segment_files(ix.storage, segment),
+                })
+            fields = {}
+            for name in sorted(reader.indexed_field_names()):
+                fields[name] = {
+                    'terms': sum(1 for _ in reader.lexicon(name)),
+                    'tokens': reader.field_length(name),
+                }
+            documents, total = reader.doc_count(), reader.doc_count_all()
+        stores = self.stores_path(self.generation)
+        files = sorted(os.listdir(stores)) if os.path.exists(stores) else []
+        return {
+            'path': os.path.realpath(self.path),
+            'version': self.version.name,
+            'generation': self.generation,
+            'profile': self.profile,
+            'meta': self.meta,
+            'documents': documents,
+            'deleted': total - documents,
+            'segments': segments,
+            'fields': fields,
+            'bytes': {
+                'index': directory_size(self.path) - directory_size(os.path.join(self.path, STORES_DIR)),
+                'stored': sum(segment['files'].get('stored', 0) for segment in segments),
+                'stores': dict((name, os.path.getsize(os.path.join(stores, name))) for name in files),
+            },
+        }
+
     @property
     def specialties(self):
         if not self._specialties:
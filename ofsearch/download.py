@@ -0,0 +1,156 @@
+'''
+Resumable and conditional dataset downloads.
+
+A dataset is streamed by chunks into a `.part` file, hashed on the fly,
+and only replaces the previous download once complete.
+An interrupted download is resumed with a `Range` request
+and an unchanged dataset is not downloaded again thanks to a conditional request
+using the `ETag` and `Last-Modified` headers kept in a `.download.json` file next to the dataset.
+'''
+import hashlib
+import json
+import os
+
+from email.message import Message
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+from .utils import ObjectDict
+
+CHUNK_SIZE = 1024 * 1024
+STATE_SUFFIX = '.download.json'
+PART_SUFFIX = '.part'
+DEFAULT_TIMEOUT = 60  # in seconds
+
+
+def sha256sum(filename, chunk_size=CHUNK_SIZE):
+    '''The SHA-256 hex digest of a file content'''
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def disposition_filename(value):
+    '''The file name given by a `Content-Disposition` header value, `None` if missing'''
+    if not value:
+        return None
+    message = Message()
+    message['Content-Disposition'] = value
+    filename = message.get_filename()
+    return os.path.basename(filename.strip()) if filename else None
+
+
+def local_filename(url, directory='.', timeout=DEFAULT_TIMEOUT):
+    '''
+    The local file an URL is downloaded to.
+
+    Its name is the one given by the server `Content-Disposition` header if any,
+    as the URL may have no extension to guess the dataset format from, the URL basename otherwise.
+    '''
+    request = Request(url, method='HEAD')
+    request.add_header('Accept-Encoding', 'identity')
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            filename = disposition_filename(response.headers.get('Content-Disposition'))
+    except HTTPError:
+        # HEAD requests are not always allowed
+        filename = None
+    return os.path.join(directory, filename or os.path.basename(urlparse(url).path) or 'dataset')
+
+
+def read_state(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(filename, state):
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(filename + '.tmp', filename)
+
+
+def validator(state):
+    '''The strongest validator known for a download: its ETag or its modification date'''
+    return state.get('etag') or state.get('last_modified')
+
+
+def download(url, directory='.', progress=None, timeout=DEFAULT_TIMEOUT):
+    '''
+    Download `url` into `directory` unless unchanged since the previous download.
+
+    `progress` is called with the number of bytes received and the expected total (or `None`).
+    Return the download details: its `filename`, its `sha256` digest, its `size`
+    and its `status` (`downloaded`, `resumed` or `unchanged`).
+    '''
+    filename = local_filename(url, directory, timeout)
+    part = filename + PART_SUFFIX
+    state_file = filename + STATE_SUFFIX
+    part_state_file = part + STATE_SUFFIX
+    state = read_state(state_file)
+
+    request = Request(url)
+    request.add_header('Accept-Encoding', 'identity')
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    part_state = read_state(part_state_file) if offset else {}
+    if offset and part_state.get('url') == url and validator(part_state):
+        request.add_header('Range', 'bytes={0}-'.format(offset))
+        request.add_header('If-Range', validator(part_state))
+    else:
+        offset = 0
+        if state.get('url') == url and os.path.exists(filename) and state.get('sha256'):
+            if state.get('etag'):
+                request.add_header('If-None-Match', state['etag'])
+            if state.get('last_modified'):
+                request.add_header('If-Modified-Since', state['last_modified'])
+
+    try:
+        response = urlopen(request, timeout=timeout)
+    except HTTPError as e:
+        if e.code == 304:
+            return ObjectDict(filename=filename, sha256=state['sha256'], size=state.get('size'), status='unchanged')
+        raise
+
+    with response:
+        headers = response.headers
+        if response.status != 206:
+            # The server ignored or refused the range: start over
+            offset = 0
+        new_state = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+        }
+        if offset and validator(new_state) and validator(new_state) != validator(part_state):
+            raise IOError('{0} changed while resuming its download'.format(url))
+        write_state(part_state_file, new_state)
+        length = headers.get('Content-Length')
+        total = offset + int(length) if length else None
+
+        digest = hashlib.sha256()
+        if offset:
+            with open(part, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+        received = offset
+        with open(part, 'ab' if offset else 'wb') as out:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                out.write(chunk)
+                digest.update(chunk)
+                received += len(chunk)
+                if progress:
+                    progress(received, total)
+
+    if total is not None and received != total:
+        raise IOError('Incomplete download of {0}: {1} bytes out of {2}'.format(url, received, total))
+    os.replace(part, filename)
+    new_state.update(sha256=digest.hexdigest(), size=received)
+    write_state(state_file, new_state)
+    os.remove(part_state_file)
+    return ObjectDict(filename=filename, sha256=new_state['sha256'], size=received,
+                      status='resumed' if offset else 'downloaded')
@@ -0,0 +1,80 @@
+'''
+Streaming serializers for full dataset exports.
+
+Serializers consume an organizations iterator and yield bytes chunks
+so an export never holds more than a chunk in memory.
+'''
+import csv
+import io
+import json
+import zlib
+
+from .database import DATASET_HEADER, FIELDS, org_to_row
+
+FORMATS = ('ndjson', 'csv')
+MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CHUNK_SIZE = 500  # Organizations per chunk
+
+
+def chunked(items, size=CHUNK_SIZE):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def to_ndjson(orgs):
+    '''Serialize organizations as newline delimited JSON, with the API fields order'''
+    for chunk in chunked(orgs):
+        lines = []
+        for org in chunk:
+            data = dict((key, org.get(key)) for key in FIELDS)
+            data['specialties'] = org.get('specialties') or []
+            lines.append(json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+        lines.append('')
+        yield '\n'.join(lines).encode('utf8')
+
+
+def to_csv(orgs):
+    '''Serialize organizations as CSV with the official dataset columns'''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    writer.writerow(DATASET_HEADER)
+    for chunk in chunked(orgs):
+        for org in chunk:
+            row = org_to_row(org)
+            writer.writerow([row.get(key) for key in DATASET_HEADER])
+        yield buffer.getvalue().encode('utf8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf8')
+
+
+SERIALIZERS = {
+    'ndjson': to_ndjson,
+    'csv': to_csv,
+}
+
+
+def gzipped(chunks):
+    '''Compress a bytes chunks stream on the fly as gzip'''
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def serialize(orgs, fmt='ndjson', gzip=False):
+    '''Serialize organizations into a bytes chunks stream'''
+    chunks = SERIALIZERS[fmt](orgs)
+    return gzipped(chunks) if gzip else chunks
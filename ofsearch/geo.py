@@ -0,0 +1,80 @@
+'''
+Postal codes and departments side store.
+
+Organizations are indexed by the postal codes of both their addresses
+and by the departments they belong to, as bitsets of document numbers:
+
+- a department filter is a single bitset lookup
+- a postal code prefix filter is the union of the bitsets of the postal codes in a sorted keys range
+'''
+import bisect
+
+from .bitsets import Bitset, union
+
+DEPARTMENT_PREFIX = 'd:'
+POSTAL_CODE_PREFIX = 'p:'
+
+
+def normalize_postal_code(value):
+    '''Normalize a postal code, restoring a leading zero lost by spreadsheets'''
+    code = str(value or '').strip().replace(' ', '')
+    if len(code) == 4 and code.isdigit():
+        code = '0' + code
+    return code
+
+
+def department(postal_code):
+    '''
+    The department code of a postal code, `None` if not a french postal code.
+
+    Corsica is split into 2A and 2B and overseas departments have 3 digits codes.
+    '''
+    code = normalize_postal_code(postal_code)
+    if len(code) != 5 or not code.isdigit():
+        return None
+    if code.startswith('20'):
+        return '2A' if code < '20200' else '2B'
+    if code.startswith(('97', '98')):
+        return code[:3]
+    return code[:2]
+
+
+def org_keys(org, fields):
+    '''The postal codes and departments bitsets keys of an organization given its postal code fields'''
+    keys = set()
+    for field in fields:
+        code = normalize_postal_code(org.get(field))
+        if code:
+            keys.add(POSTAL_CODE_PREFIX + code)
+            dept = department(code)
+            if dept:
+                keys.add(DEPARTMENT_PREFIX + dept)
+    return keys
+
+
+class GeoIndex(object):
+    '''Resolve postal code prefixes and departments into bitsets'''
+    def __init__(self, bitsets):
+        self.departments = dict(
+            (key[len(DEPARTMENT_PREFIX):], bitset) for key, bitset in bitsets.items()
+            if key.startswith(DEPARTMENT_PREFIX)
+        )
+        self._codes = dict(
+            (key[len(POSTAL_CODE_PREFIX):], bitset) for key, bitset in bitsets.items()
+            if key.startswith(POSTAL_CODE_PREFIX)
+        )
+        self._sorted = sorted(self._codes)
+
+    def department(self, code):
+        '''Documents in a department, given as in the postal codes (ie. `01`, `2A` or `974`)'''
+        code = code.strip().upper()
+        if len(code) == 1 and code.isdigit():
+            code = '0' + code
+        return self.departments.get(code, Bitset())
+
+    def postal_code(self, prefix):
+        '''Documents with a postal code starting with `prefix`'''
+        prefix = prefix.strip()
+        start = bisect.bisect_left(self._sorted, prefix)
+        end = bisect.bisect_left(self._sorted, prefix + '\uffff')
+        return union(self._codes[code] for code in self._sorted[start:end])
@@ -0,0 +1,23 @@
+'''
+Gunicorn settings loading the application once in the master process.
+
+Read-only data is preloaded before forking so that workers share it copy-on-write:
+
+    gunicorn ofsearch.heroku:app -c python:ofsearch.gunicorn
+'''
+from .utils import memory_usage
+
+preload_app = True
+worker_class = 'gevent'
+
+
+def when_ready(server):
+    from .heroku import db
+    db.preload()
+    server.log.info('Preloaded index version %s: %s', db.version.name, memory_usage())
+
+
+def post_worker_init(worker):
+    from .heroku import db
+    db.after_fork()
+    worker.log.info('Worker %s memory: %s', worker.pid, memory_usage())
@@ -1,16 +1,27 @@
-from flask import Flask
 from werkzeug.contrib.fixers import ProxyFix
 
-from .api import api
-from .database import DB
-from .utils import ObjectDict
+from .api import DEFAULT_MAX_BATCH, DEFAULT_MAX_CONCURRENT
+from .app import create_app
+from .cache import DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL
+from .database import DB, DEFAULT_GRACE_PERIOD, DEFAULT_POOL_SIZE, DEFAULT_QUERY_SYNTAX, DEFAULT_TIME_LIMIT
+from .metrics import DEFAULT_SLOW_QUERY
+from .utils import config_from_env
 
-config = ObjectDict(verbose=False, index='.index')
+config = config_from_env(
+    verbose=False,
+    index='.index',
+    cache_size=DEFAULT_CACHE_SIZE,
+    cache_ttl=DEFAULT_CACHE_TTL,
+    cache_control='',
+    searchers=DEFAULT_POOL_SIZE,
+    max_batch=DEFAULT_MAX_BATCH,
+    grace_period=DEFAULT_GRACE_PERIOD,
+    slow_query=DEFAULT_SLOW_QUERY,
+    time_limit=DEFAULT_TIME_LIMIT,
+    query_syntax=DEFAULT_QUERY_SYNTAX,
+    max_concurrent=DEFAULT_MAX_CONCURRENT,
+)
 db = DB(config)
 
-app = Flask(__name__)
+app = create_app(db)
 app.wsgi_app = ProxyFix(app.wsgi_app)
-app.config.SWAGGER_UI_DOC_EXPANSION = 'list'
-
-api.init_app(app)
-db.init_app(app)
@@ -0,0 +1,123 @@
+'''
+A compact memory-mappable identifier lookup table.
+
+The table file is made of:
+
+- a header with a magic string and the number of entries
+- fixed-width entries sorted by key: a NUL-padded key, a record offset and a record length
+- the JSON serialized records, referenced by the entries
+
+so an identifier is resolved with a single binary search on the mapped file.
+'''
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+MAGIC = b'OFID1'
+KEY_SIZE = 14  # A SIRET is the longest identifier
+HEADER = struct.Struct('<5sI')
+ENTRY = struct.Struct('<{0}sQI'.format(KEY_SIZE))
+POINTER = struct.Struct('<QI')
+
+
+def encode_key(identifier):
+    '''Encode an identifier into a fixed-width key or `None` if not encodable'''
+    if not identifier:
+        return None
+    try:
+        key = str(identifier).strip().encode('ascii')
+    except UnicodeEncodeError:
+        return None
+    if not key or len(key) > KEY_SIZE:
+        return None
+    return key.ljust(KEY_SIZE, b'\0')
+
+
+class TableWriter(object):
+    '''
+    Build and write an identifier table.
+
+    The first record wins when an identifier is duplicated.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self._entries = []
+        self._records = tempfile.TemporaryFile()
+
+    def add(self, identifiers, record):
+        '''Add a JSON serializable or already serialized record reachable by any of the given identifiers'''
+        if isinstance(record, bytes):
+            data = record
+        else:
+            data = json.dumps(record, separators=(',', ':')).encode('utf8')
+        offset = self._records.tell()
+        self._records.write(data)
+        for identifier in identifiers:
+            key = encode_key(identifier)
+            if key:
+                self._entries.append((key, offset, len(data)))
+
+    def close(self):
+        entries = self._entries
+        entries.sort(key=lambda e: e[0])  # Stable so the first record wins
+        self._records.seek(0)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, len(entries)))
+            for entry in entries:
+                out.write(ENTRY.pack(*entry))
+            shutil.copyfileobj(self._records, out)
+        self._records.close()
+        os.replace(tmp, self.filename)
+
+
+class IdentifierTable(object):
+    '''A read-only memory-mapped identifier table'''
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('{0} is not an identifier table'.format(filename))
+        self._records = HEADER.size + self._count * ENTRY.size
+
+    def __len__(self):
+        return self._count
+
+    def _find(self, key):
+        '''Binary search the entry position matching `key`'''
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = HEADER.size + mid * ENTRY.size
+            if self._map[start:start + KEY_SIZE] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count:
+            start = HEADER.size + lo * ENTRY.size
+            if self._map[start:start + KEY_SIZE] == key:
+                return start
+        return None
+
+    def raw(self, identifier):
+        '''Get the serialized record matching `identifier` or `None`'''
+        key = encode_key(identifier)
+        position = self._find(key) if key else None
+        if position is None:
+            return None
+        offset, length = POINTER.unpack_from(self._map, position + KEY_SIZE)
+        start = self._records + offset
+        return self._map[start:start + length]
+
+    def get(self, identifier):
+        '''Get the record matching `identifier` or `None`'''
+        data = self.raw(identifier)
+        return None if data is None else json.loads(data.decode('utf8'))
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,218 @@
+'''
+Request instrumentation.
+
+Requests processing stages are timed, aggregated into histograms
+and rendered in the Prometheus text exposition format.
+Requests slower than a threshold are logged with their stages breakdown.
+Metrics recorded by other processes (ie. the async mode search processes) can be merged in.
+'''
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+log = logging.getLogger('ofsearch.slowlog')
+
+DEFAULT_SLOW_QUERY = 500  # in milliseconds
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+COUNTERS = ('slow_queries', 'partial_results', 'rejected')
+CACHE_COUNTERS = ('hits', 'misses', 'evictions', 'size')
+
+
+class Histogram(object):
+    '''A cumulative histogram of durations in seconds'''
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def take(self):
+        '''The observations so far as `(counts, count, sum)`, starting over'''
+        with self._lock:
+            observed = (self.counts, self.count, self.sum)
+            self.counts, self.count, self.sum = [0] * len(self.buckets), 0, 0.0
+        return observed
+
+    def add(self, counts, count, total):
+        '''Add the observations taken from a histogram with the same buckets'''
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+            self.count += count
+            self.sum += total
+
+    def render(self, name, labels):
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets, counts):
+            cumulative += bucket
+            lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(name, labels, bound, cumulative))
+        lines.append('{0}_bucket{{{1},le="+Inf"}} {2}'.format(name, labels, count))
+        lines.append('{0}_sum{{{1}}} {2}'.format(name, labels, total))
+        lines.append('{0}_count{{{1}}} {2}'.format(name, labels, count))
+        return lines
+
+
+class Trace(object):
+    '''The stages timings of a single request'''
+    def __init__(self, endpoint, details):
+        self.endpoint = endpoint
+        self.details = details
+        self.stages = OrderedDict()
+        self.start = time.perf_counter()
+
+    def add(self, stage, duration):
+        self.stages[stage] = self.stages.get(stage, 0) + duration
+
+    def breakdown(self):
+        return ' '.join('{0}={1:.1f}ms'.format(k, v * 1000) for k, v in self.stages.items())
+
+
+class Metrics(object):
+    '''Collect requests and stages timings'''
+    def __init__(self, slow_query=DEFAULT_SLOW_QUERY):
+        self.slow_query = slow_query / 1000 if slow_query else None
+        self.requests = {}
+        self.stages = {}
+        self.slow_queries = 0
+        self.partial_results = 0
+        self.rejected = 0
+        # The latest caches statistics of other processes by pid
+        self.processes = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _histogram(self, histograms, name):
+        histogram = histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = histograms.setdefault(name, Histogram())
+        return histogram
+
+    @property
+    def current(self):
+        '''The trace of the request being processed if any'''
+        return getattr(self._local, 'trace', None)
+
+    @contextmanager
+    def trace(self, endpoint, **details):
+        '''Time a request, logging it with its stages breakdown if slow'''
+        trace = self._local.trace = Trace(endpoint, details)
+        try:
+            yield trace
+        finally:
+            self._local.trace = None
+            duration = time.perf_counter() - trace.start
+            self._histogram(self.requests, endpoint).observe(duration)
+            if self.slow_query and duration >= self.slow_query:
+                self.slow_queries += 1
+                log.warning('Slow %s request (%.1fms) %r: %s',
+                            endpoint, duration * 1000, details, trace.breakdown())
+
+    @contextmanager
+    def stage(self, name):
+        '''Time a processing stage of the current request'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self._histogram(self.stages, name).observe(duration)
+            trace = self.current
+            if trace is not None:
+                trace.add(name, duration)
+
+    def collect(self, caches=None):
+        '''
+        Take the timings and counters recorded since the previous collect,
+        along with the current `caches` statistics, to be merged into the metrics of another process.
+        '''
+        collected = {'pid': os.getpid(), 'caches': caches or {}}
+        for name, histograms in (('requests', self.requests), ('stages', self.stages)):
+            collected[name] = dict((key, histogram.take()) for key, histogram in list(histograms.items()))
+        for counter in COUNTERS:
+            collected[counter] = getattr(self, counter)
+            setattr(self, counter, 0)
+        return collected
+
+    def merge(self, collected):
+        '''Add metrics collected by another process'''
+        for name, histograms in (('requests', self.requests), ('stages', self.stages)):
+            for key, observed in collected[name].items():
+                if observed[1]:
+                    self._histogram(histograms, key).add(*observed)
+        for counter in COUNTERS:
+            setattr(self, counter, getattr(self, counter) + collected[counter])
+        self.processes[collected['pid']] = collected['caches']
+
+    def caches(self, caches):
+        '''Sum the caches statistics of this process and of the merged ones'''
+        totals = dict((cache, dict(values)) for cache, values in caches.items())
+        for process in self.processes.values():
+            for cache, values in process.items():
+                total = totals.setdefault(cache, dict.fromkeys(CACHE_COUNTERS, 0))
+                for counter in CACHE_COUNTERS:
+                    total[counter] += values[counter]
+        return totals
+
+    def render(self, stats):
+        '''Render the metrics and the DB statistics in the Prometheus text format'''
+        lines = [
+            '# HELP ofsearch_request_seconds Requests processing time per endpoint',
+            '# TYPE ofsearch_request_seconds histogram',
+        ]
+        for endpoint, histogram in sorted(self.requests.items()):
+            lines.extend(histogram.render('ofsearch_request_seconds', 'endpoint="{0}"'.format(endpoint)))
+        lines.extend([
+            '# HELP ofsearch_stage_seconds Requests processing time per stage',
+            '# TYPE ofsearch_stage_seconds histogram',
+        ])
+        for stage, histogram in sorted(self.stages.items()):
+            lines.extend(histogram.render('ofsearch_stage_seconds', 'stage="{0}"'.format(stage)))
+        lines.extend([
+            '# HELP ofsearch_slow_queries_total Requests slower than the slow query threshold',
+            '# TYPE ofsearch_slow_queries_total counter',
+            'ofsearch_slow_queries_total {0}'.format(self.slow_queries),
+            '# HELP ofsearch_partial_results_total Searches stopped by the time limit',
+            '# TYPE ofsearch_partial_results_total counter',
+            'ofsearch_partial_results_total {0}'.format(self.partial_results),
+            '# HELP ofsearch_rejected_requests_total Requests rejected by the concurrency limit',
+            '# TYPE ofsearch_rejected_requests_total counter',
+            'ofsearch_rejected_requests_total {0}'.format(self.rejected),
+        ])
+        for name in ('generation', 'segments', 'documents'):
+            lines.extend([
+                '# TYPE ofsearch_index_{0} gauge'.format(name),
+                'ofsearch_index_{0} {1}'.format(name, stats[name]),
+            ])
+        caches = self.caches(stats['caches'])
+        for counter in ('hits', 'misses', 'evictions'):
+            lines.append('# TYPE ofsearch_cache_{0}_total counter'.format(counter))
+            for cache, values in sorted(caches.items()):
+                lines.append('ofsearch_cache_{0}_total{{cache="{1}"}} {2}'.format(counter, cache, values[counter]))
+        lines.append('# TYPE ofsearch_cache_size gauge')
+        for cache, values in sorted(caches.items()):
+            lines.append('ofsearch_cache_size{{cache="{0}"}} {1}'.format(cache, values['size']))
+        if stats.get('memory'):
+            lines.append('# TYPE ofsearch_process_memory_megabytes gauge')
+            for kind, value in sorted(stats['memory'].items()):
+                if value is not None:
+                    lines.append('ofsearch_process_memory_megabytes{{kind="{0}",pid="{1}"}} {2}'.format(
+                        kind, stats['pid'], value))
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,63 @@
+'''
+Single query profiling.
+
+A search is run the way the API does (parsing, searching, loading the organizations and marshalling),
+under `cProfile` and `tracemalloc`, with its stages timings recorded by the metrics.
+'''
+import cProfile
+import time
+import tracemalloc
+
+from flask_restplus import marshal
+
+from . import serializer
+from .api import search_results
+from .database import DB
+from .utils import ObjectDict
+
+DEFAULT_TOP = 20
+TRACEMALLOC_FRAMES = 10
+
+
+def profile_query(config, query, warm=True, top=DEFAULT_TOP, **kwargs):
+    '''
+    Profile a search for `query`, extra keyword arguments being given to `DB.search`.
+
+    Caches are disabled, and the lazily opened index and side stores
+    are loaded by a first untracked search if `warm`.
+    '''
+    db = DB(ObjectDict(config, cache_size=0))
+    if warm:
+        db.search(query, raw=True, **kwargs)
+    profiler = cProfile.Profile()
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    start = time.perf_counter()
+    try:
+        profiler.enable()
+        with db.metrics.trace('profile', q=query) as trace:
+            result = db.search(query, raw=True, **kwargs)
+            with db.metrics.stage('marshal'):
+                documents = result.pop('results')
+                body = serializer.splice(marshal(result, search_results), 'results', documents)
+        profiler.disable()
+        duration = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    allocations = [
+        ObjectDict(where=str(stat.traceback[0]), size=stat.size, count=stat.count)
+        for stat in snapshot.statistics('lineno')[:top]
+    ]
+    return ObjectDict(
+        query=query,
+        total=result['total'],
+        partial=result.get('partial'),
+        results=len(documents),
+        bytes=len(body),
+        duration=duration,
+        stages=trace.stages,
+        memory=ObjectDict(current=current, peak=peak),
+        allocations=allocations,
+        profiler=profiler,
+    )
@@ -0,0 +1,166 @@
+'''
+Streaming dataset readers.
+
+Each reader yields the header row then every data row as plain tuples,
+so a whole dataset is never loaded in memory.
+'''
+import csv
+import gzip
+import io
+import json
+import multiprocessing
+
+from collections import deque
+from functools import partial
+
+from openpyxl import load_workbook
+
+DEFAULT_BATCH_SIZE = 1000
+CSV_DELIMITERS = ';,\t'
+# The official dataset delimiter, used when it can not be detected
+DEFAULT_CSV_DELIMITER = ';'
+
+
+def read_xlsx(filename):
+    '''Read the first sheet of an Excel workbook'''
+    wb = load_workbook(filename, read_only=True)
+    sheet = wb.active  # Only the first sheet is relevant
+    try:
+        for row in sheet.iter_rows(values_only=True):
+            yield row
+    finally:
+        wb.close()
+
+
+def count_xlsx(filename):
+    '''Get the number of data rows from the workbook dimensions'''
+    wb = load_workbook(filename, read_only=True)
+    try:
+        max_row = wb.active.max_row
+        return max_row - 1 if max_row else None
+    finally:
+        wb.close()
+
+
+def _read_csv(f):
+    sample = f.read(4096)
+    f.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=CSV_DELIMITERS)
+    except csv.Error:
+        dialect = None
+    rows = csv.reader(f, dialect) if dialect else csv.reader(f, delimiter=DEFAULT_CSV_DELIMITER)
+    for row in rows:
+        yield tuple(value or None for value in row)
+
+
+def read_csv(filename):
+    '''Read a CSV file, the delimiter is detected'''
+    with io.open(filename, encoding='utf-8-sig', newline='') as f:
+        yield from _read_csv(f)
+
+
+def read_csv_gz(filename):
+    '''Read a gzipped CSV file, the delimiter is detected'''
+    with gzip.open(filename, 'rt', encoding='utf-8-sig', newline='') as f:
+        yield from _read_csv(f)
+
+
+def read_ndjson(filename):
+    '''Read a newline delimited JSON file, the header is given by the first object keys'''
+    opener = gzip.open if filename.endswith('.gz') else io.open
+    with opener(filename, 'rt', encoding='utf-8') as f:
+        header = None
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            obj = json.loads(line)
+            if header is None:
+                header = tuple(obj.keys())
+                yield header
+            yield tuple(obj.get(key) for key in header)
+
+
+READERS = {
+    'xlsx': read_xlsx,
+    'csv': read_csv,
+    'csv.gz': read_csv_gz,
+    'ndjson': read_ndjson,
+}
+
+# Formats able to count their rows without reading them all
+COUNTERS = {
+    'xlsx': count_xlsx,
+}
+
+EXTENSIONS = (
+    ('.xlsx', 'xlsx'),
+    ('.csv.gz', 'csv.gz'),
+    ('.csv', 'csv'),
+    ('.ndjson', 'ndjson'),
+    ('.ndjson.gz', 'ndjson'),
+    ('.jsonl', 'ndjson'),
+    ('.jsonl.gz', 'ndjson'),
+)
+
+
+def guess_format(filename):
+    '''Guess a dataset format given its filename'''
+    lower = filename.lower()
+    for extension, fmt in EXTENSIONS:
+        if lower.endswith(extension):
+            return fmt
+
+
+def read(filename, fmt=None):
+    '''
+    Stream a dataset file.
+
+    Return the header as a tuple, an iterator over the remaining rows
+    and the number of rows if it is known in advance.
+    '''
+    fmt = fmt or guess_format(filename)
+    if fmt not in READERS:
+        raise ValueError('Unknown dataset format for {0}'.format(filename))
+    total = COUNTERS[fmt](filename) if fmt in COUNTERS else None
+    rows = READERS[fmt](filename)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError('{0} is empty'.format(filename))
+    return tuple(header), rows, total
+
+
+def batches(rows, size=DEFAULT_BATCH_SIZE):
+    '''Group rows into lists of at most `size` items'''
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def process(func, header, rows, workers=0, size=DEFAULT_BATCH_SIZE):
+    '''
+    Apply `func(header, batch)` on batches of rows.
+
+    Batches are processed in a pool of `workers` processes if given
+    with a bounded number of pending batches, in-process otherwise.
+    Results are yielded in order.
+    '''
+    if not workers:
+        for batch in batches(rows, size):
+            yield func(header, batch)
+        return
+    task = partial(func, header)
+    with multiprocessing.Pool(workers) as pool:
+        pending = deque()
+        for batch in batches(rows, size):
+            pending.append(pool.apply_async(task, (batch,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
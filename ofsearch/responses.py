@@ -0,0 +1,149 @@
+'''
+HTTP caching and compression.
+
+Responses carry a strong `ETag` derived from what they are built from
+(ie. the served index version and generation and the request arguments),
+so a conditional request is answered with a `304 Not Modified` before doing any work.
+Bodies are compressed with brotli (if installed) or gzip depending on the `Accept-Encoding`,
+static ones once for all at startup.
+'''
+import gzip
+import hashlib
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies are sent as is
+MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Static bodies are compressed once so at the highest level
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain')
+CACHE_CONTROL = {
+    'search': 'public, max-age=60',
+    'suggest': 'public, max-age=300',
+    'display': 'public, max-age=300',
+    'export': 'public, max-age=300',
+    'specialties': 'public, max-age=86400',
+    'status': 'no-cache',
+    'metrics': 'no-cache',
+}
+
+
+def parse_cache_control(value):
+    '''
+    Parse `Cache-Control` headers per endpoint given as `endpoint=directives` separated by `;`
+    (ie. `search=no-cache; specialties=public, max-age=604800`) over the defaults.
+    '''
+    headers = dict(CACHE_CONTROL)
+    for item in (value or '').split(';'):
+        if not item.strip():
+            continue
+        endpoint, _, directives = item.partition('=')
+        if not directives.strip():
+            raise ValueError('Expected "endpoint=directives", got "{0}"'.format(item.strip()))
+        headers[endpoint.strip()] = directives.strip()
+    return headers
+
+
+def make_etag(*parts):
+    '''A strong entity tag from what a response is built from'''
+    return hashlib.sha1(repr(parts).encode('utf8')).hexdigest()
+
+
+def encodings():
+    '''Supported content codings, preferred first'''
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate():
+    '''The preferred content coding accepted by the client, `None` for the identity'''
+    accepted = request.accept_encodings
+    for encoding in encodings():
+        if accepted[encoding]:
+            return encoding
+
+
+def compress(body, encoding, static=False):
+    if encoding == 'br':
+        return brotli.compress(body, quality=STATIC_BROTLI_QUALITY if static else BROTLI_QUALITY)
+    return gzip.compress(body, STATIC_GZIP_LEVEL if static else GZIP_LEVEL)
+
+
+def representation_etag(etag, encoding):
+    '''Each content coding of a resource is a distinct representation with its own strong tag'''
+    return '{0}-{1}'.format(etag, encoding) if encoding else etag
+
+
+def not_modified(etag):
+    '''A `304 Not Modified` response if the client already has a representation of `etag`, else `None`'''
+    if_none_match = request.if_none_match
+    if not if_none_match:
+        return None
+    for candidate in (etag,) + tuple(representation_etag(etag, encoding) for encoding in ('br', 'gzip')):
+        if if_none_match.contains(candidate):
+            response = Response(status=304)
+            response.set_etag(candidate)
+            response.vary.add('Accept-Encoding')
+            return response
+
+
+class Precompressed(object):
+    '''A static body and its compressed variants, computed once'''
+    def __init__(self, body, mimetype='application/json'):
+        self.mimetype = mimetype
+        self.etag = make_etag(body)
+        self.bodies = {None: body}
+        if len(body) >= MIN_SIZE:
+            for encoding in encodings():
+                self.bodies[encoding] = compress(body, encoding, static=True)
+
+    def response(self):
+        response = not_modified(self.etag)
+        if response is not None:
+            return response
+        encoding = negotiate()
+        if encoding not in self.bodies:
+            encoding = None
+        response = Response(self.bodies[encoding], mimetype=self.mimetype)
+        response.set_etag(representation_etag(self.etag, encoding))
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if len(self.bodies) > 1:
+            response.vary.add('Accept-Encoding')
+        return response
+
+
+def finalize(response, cache_control=None):
+    '''
+    Add the `Cache-Control` header, compress the body if possible (suffixing the entity tag with the content coding)
+    and turn the response into a `304 Not Modified` if the client already has it.
+    '''
+    if cache_control and 'Cache-Control' not in response.headers and response.status_code in (200, 304):
+        response.headers['Cache-Control'] = cache_control
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE):
+        return response
+    body = response.get_data()
+    if len(body) >= MIN_SIZE:
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate()
+        if encoding is not None:
+            response.set_data(compress(body, encoding))
+            response.headers['Content-Encoding'] = encoding
+            etag, weak = response.get_etag()
+            if etag and not weak:
+                response.set_etag(representation_etag(etag, encoding))
+    etag, weak = response.get_etag()
+    if etag and not weak and request.if_none_match.contains(etag):
+        modified, response = response, Response(status=304)
+        for header in ('ETag', 'Cache-Control', 'Vary'):
+            if header in modified.headers:
+                response.headers[header] = modified.headers[header]
+    return response
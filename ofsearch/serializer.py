@@ -0,0 +1,95 @@
+'''
+Pre-serialized organizations.
+
+Organizations are serialized once at load time exactly as the API marshals them,
+so responses are built by concatenating JSON bytes instead of marshalling every hit.
+
+The documents store is made of the concatenated JSON documents
+and a memory-mapped NumPy array of their offsets indexed by document number.
+'''
+import json
+import mmap
+import os
+
+import numpy as np
+
+from flask_restplus import marshal
+
+try:
+    import rapidjson
+except ImportError:
+    rapidjson = None
+
+DOCUMENTS_FILE = 'documents.json'
+OFFSETS_FILE = 'documents.npy'
+# Lists items separator matching the JSON library output
+SEPARATOR = b',' if rapidjson else b', '
+
+
+def dumps(data):
+    '''Serialize into JSON bytes, using `rapidjson` if available'''
+    if rapidjson is not None:
+        return rapidjson.dumps(data).encode('utf8')
+    return json.dumps(data).encode('utf8')
+
+
+def to_json(org):
+    '''Serialize an organization as marshalled with the `Organization` API model'''
+    from .api import organization  # The API module depends on this one
+    return dumps(marshal(org, organization))
+
+
+def splice(envelope, key, documents):
+    '''Serialize a marshalled `envelope` whose `key` list is made of pre-serialized `documents`'''
+    envelope[key] = []
+    marker = dumps({key: []})[1:-1]
+    # Any quote in a string value is escaped so the marker can only match the key
+    return dumps(envelope).replace(marker, marker[:-1] + SEPARATOR.join(documents) + b']', 1)
+
+
+class DocumentsWriter(object):
+    '''Build and write the documents store of `size` documents, added by increasing document number'''
+    def __init__(self, path, size):
+        self.path = path
+        self._offsets = np.zeros(size + 1, dtype=np.uint64)
+        self._next = 0
+        self._tmp = os.path.join(path, DOCUMENTS_FILE + '.tmp')
+        self._out = open(self._tmp, 'wb')
+
+    def add(self, docnum, data):
+        position = self._out.tell()
+        # Deleted documents are empty
+        self._offsets[self._next:docnum + 1] = position
+        self._out.write(data)
+        self._next = docnum + 1
+
+    def close(self):
+        self._offsets[self._next:] = self._out.tell()
+        self._out.close()
+        os.replace(self._tmp, os.path.join(self.path, DOCUMENTS_FILE))
+        filename = os.path.join(self.path, OFFSETS_FILE)
+        np.save(filename + '.tmp.npy', self._offsets)
+        os.replace(filename + '.tmp.npy', filename)
+
+
+class Documents(object):
+    '''A read-only memory-mapped documents store'''
+    def __init__(self, path):
+        self._offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode='r')
+        with open(os.path.join(path, DOCUMENTS_FILE), 'rb') as f:
+            # mmap refuses empty files
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, docnum):
+        '''The serialized document, empty if deleted'''
+        return self._map[int(self._offsets[docnum]):int(self._offsets[docnum + 1])]
+
+
+def read_documents(path):
+    '''Open the documents store, `None` if missing'''
+    if not os.path.exists(os.path.join(path, OFFSETS_FILE)):
+        return None
+    return Documents(path)
@@ -0,0 +1,156 @@
+'''
+Organization names spelling correction.
+
+A SymSpell-like deletion dictionary: every word of the names vocabulary is indexed
+by the strings obtained by deleting up to `max_distance` characters from its prefix.
+A misspelled word shares at least one deletion with its corrections,
+so candidates are found with a few lookups instead of a scan of the vocabulary
+and only those are checked with an actual edit distance.
+
+Deletions are stored as a sorted memory-mapped array of their CRC32,
+hash collisions only adding candidates rejected by the distance check.
+'''
+import gzip
+import json
+import os
+import re
+import zlib
+
+from itertools import combinations
+
+import numpy as np
+
+WORDS_FILE = 'spelling.json.gz'
+DELETES_FILE = 'spelling.npy'
+DEFAULT_MAX_DISTANCE = 2
+PREFIX_LENGTH = 7
+# Shorter words are left untouched, longer ones can be corrected with `max_distance` edits, others with a single one
+MIN_LENGTH = 4
+LONG_LENGTH = 8
+OPERATORS = ('AND', 'OR', 'NOT', 'ANDNOT', 'ANDMAYBE', 'TO')
+RE_WORD = re.compile(r'\w+')
+# Field names, quoted phrases and ranges are kept as is
+RE_TOKEN = re.compile(r'"[^"]*"|\[[^\]]*\]|\{[^}]*\}|\w+:|\w+')
+
+
+def words(name):
+    '''The lowercased words of a name'''
+    return RE_WORD.findall((name or '').lower())
+
+
+def deletes(word, max_distance=DEFAULT_MAX_DISTANCE, prefix_length=PREFIX_LENGTH):
+    '''The strings obtained by deleting up to `max_distance` characters from the prefix of `word`'''
+    word = word[:prefix_length]
+    results = set([word])
+    for distance in range(1, min(max_distance, len(word) - 1) + 1):
+        for positions in combinations(range(len(word)), distance):
+            results.add(''.join(c for i, c in enumerate(word) if i not in positions))
+    return results
+
+
+def key(value):
+    return zlib.crc32(value.encode('utf8'))
+
+
+def distance(a, b, limit):
+    '''Optimal string alignment distance between `a` and `b`, `limit + 1` when greater than `limit`'''
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return current[-1]
+
+
+class SpellingWriter(object):
+    '''Build and write the names vocabulary and its deletion dictionary'''
+    def __init__(self, path, max_distance=DEFAULT_MAX_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self._counts = {}
+
+    def add(self, name):
+        for word in set(words(name)):
+            self._counts[word] = self._counts.get(word, 0) + 1
+
+    def close(self):
+        vocabulary = sorted(self._counts)
+        hashes, refs = [], []
+        for ref, word in enumerate(vocabulary):
+            for deletion in deletes(word, self.max_distance):
+                hashes.append(key(deletion))
+                refs.append(ref)
+        table = np.array([hashes, refs], dtype=np.uint32).reshape(2, len(hashes))
+        table = table[:, np.argsort(table[0], kind='stable')]
+        filename = os.path.join(self.path, DELETES_FILE)
+        np.save(filename + '.tmp.npy', np.ascontiguousarray(table))
+        os.replace(filename + '.tmp.npy', filename)
+        filename = os.path.join(self.path, WORDS_FILE)
+        data = {
+            'max_distance': self.max_distance,
+            'words': vocabulary,
+            'counts': [self._counts[word] for word in vocabulary],
+        }
+        with gzip.open(filename + '.tmp', 'wt', encoding='utf8') as out:
+            json.dump(data, out, separators=(',', ':'))
+        os.replace(filename + '.tmp', filename)
+
+
+class Speller(object):
+    '''Correct words and queries against the names vocabulary'''
+    def __init__(self, path):
+        with gzip.open(os.path.join(path, WORDS_FILE), 'rt', encoding='utf8') as f:
+            data = json.load(f)
+        self.max_distance = data['max_distance']
+        self.words = data['words']
+        self.counts = data['counts']
+        self.known = dict((word, ref) for ref, word in enumerate(self.words))
+        table = np.load(os.path.join(path, DELETES_FILE), mmap_mode='r')
+        self.hashes, self.refs = table[0], table[1]
+
+    def candidates(self, word, max_distance):
+        '''The vocabulary references sharing a deletion with `word`'''
+        hashes = np.array(sorted(key(d) for d in deletes(word, max_distance)), dtype=np.uint32)
+        starts = np.searchsorted(self.hashes, hashes, side='left')
+        ends = np.searchsorted(self.hashes, hashes, side='right')
+        refs = set()
+        for start, end in zip(starts, ends):
+            refs.update(int(ref) for ref in self.refs[start:end])
+        return refs
+
+    def correct(self, word):
+        '''The closest and most frequent known word, `word` itself if known or without close enough word'''
+        lower = word.lower()
+        if lower in self.known or len(lower) < MIN_LENGTH or not lower.isalpha():
+            return word
+        max_distance = self.max_distance if len(lower) >= LONG_LENGTH else min(self.max_distance, 1)
+        best, best_key = word, None
+        for ref in self.candidates(lower, max_distance):
+            candidate = self.words[ref]
+            d = distance(lower, candidate, max_distance)
+            if d <= max_distance and (best_key is None or (d, -self.counts[ref]) < best_key):
+                best, best_key = candidate, (d, -self.counts[ref])
+        return best
+
+    def correct_query(self, query):
+        '''Rewrite the misspelled words of a query, leaving its syntax untouched'''
+        def replace(match):
+            token = match.group(0)
+            if token in OPERATORS or not token[-1].isalnum():
+                return token
+            return self.correct(token) if RE_WORD.fullmatch(token) else token
+        return RE_TOKEN.sub(replace, query)
+
+
+def read_speller(path):
+    '''Open the spelling dictionary, `None` if missing'''
+    if not os.path.exists(os.path.join(path, DELETES_FILE)):
+        return None
+    return Speller(path)
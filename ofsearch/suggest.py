@@ -0,0 +1,97 @@
+'''
+Organization names autocompletion.
+
+Suggestions are served from an in-memory sorted array of normalized name tails
+(the name starting at each of its words) searched by bisection.
+The most popular completions of short prefixes, which match too many names
+to be ranked on the fly, are precomputed.
+'''
+import gzip
+import heapq
+import json
+import os
+import re
+import unicodedata
+
+from bisect import bisect_left
+
+MAX_SUGGESTIONS = 20
+TOP_PREFIX_LENGTH = 3
+RE_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+
+def normalize_name(value):
+    '''Lowercase, strip accents and punctuation'''
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(c for c in value if not unicodedata.combining(c)).lower()
+    return RE_NON_ALNUM.sub(' ', value).strip()
+
+
+def tails(name):
+    '''The normalized name starting at each of its words'''
+    words = normalize_name(name).split()
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def rank(docs, refs, limit=MAX_SUGGESTIONS):
+    '''The `limit` most popular distinct documents'''
+    return heapq.nsmallest(limit, set(refs), key=lambda ref: (-docs[ref][2], docs[ref][1]))
+
+
+class SuggestWriter(object):
+    '''Build and write the suggestions data'''
+    def __init__(self, filename):
+        self.filename = filename
+        self._entries = []
+        self._docs = []
+
+    def add(self, identifier, name, score):
+        '''Add a suggestion for `name` ranked by `score`'''
+        if not name:
+            return
+        ref = len(self._docs)
+        self._docs.append((identifier, name, score or 0))
+        for tail in tails(name):
+            self._entries.append((tail, ref))
+
+    def close(self):
+        self._entries.sort()
+        prefixes = {}
+        for key, ref in self._entries:
+            for size in range(1, min(TOP_PREFIX_LENGTH, len(key)) + 1):
+                prefixes.setdefault(key[:size], []).append(ref)
+        data = {
+            'keys': [key for key, _ in self._entries],
+            'refs': [ref for _, ref in self._entries],
+            'docs': self._docs,
+            'top': dict((prefix, rank(self._docs, refs)) for prefix, refs in prefixes.items()),
+        }
+        tmp = self.filename + '.tmp'
+        with gzip.open(tmp, 'wt', encoding='utf8') as out:
+            json.dump(data, out, separators=(',', ':'))
+        os.replace(tmp, self.filename)
+
+
+class Suggester(object):
+    '''Serve name completions'''
+    def __init__(self, filename):
+        with gzip.open(filename, 'rt', encoding='utf8') as f:
+            data = json.load(f)
+        self.keys = data['keys']
+        self.refs = data['refs']
+        self.docs = data['docs']
+        self.top = data['top']
+
+    def suggest(self, prefix, limit=10):
+        '''Suggest up to `limit` organizations whose name has a word starting with `prefix`'''
+        prefix = normalize_name(prefix)
+        if not prefix:
+            return []
+        limit = min(limit, MAX_SUGGESTIONS)
+        if len(prefix) <= TOP_PREFIX_LENGTH:
+            refs = self.top.get(prefix, [])[:limit]
+        else:
+            lo = bisect_left(self.keys, prefix)
+            hi = bisect_left(self.keys, prefix + '\uffff', lo)
+            refs = rank(self.docs, self.refs[lo:hi], limit)
+        return [{'id': self.docs[ref][0], 'name': self.docs[ref][1]} for ref in refs]
@@ -14,6 +14,65 @@ class ObjectDict(dict):
         self[key] = value
 
 
+def config_from_env(prefix='OFSEARCH', **defaults):
+    '''
+    Build a configuration from `<PREFIX>_<KEY>` environment variables.
+
+    Values are casted to the type of their default.
+    '''
+    config = ObjectDict(defaults)
+    for key, default in defaults.items():
+        value = os.environ.get('_'.join((prefix, key.upper())))
+        if value is None:
+            continue
+        elif isinstance(default, bool):
+            config[key] = value.lower() in ('1', 'true', 'yes', 'on')
+        elif default is not None:
+            config[key] = type(default)(value)
+        else:
+            config[key] = value
+    return config
+
+
+def directory_size(path):
+    '''The total size of the files in a directory tree (in bytes)'''
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def memory_usage(pid='self'):
+    '''
+    The resident memory of a process (in Mb) split into shared and private pages, `None` without `/proc`.
+
+    The proportional set size (`pss`) divides shared pages between the processes sharing them.
+    '''
+    values = {}
+    try:
+        with open('/proc/{0}/smaps_rollup'.format(pid)) as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if value.endswith('kB\n'):
+                    values[key] = int(value.split()[0])
+    except OSError:
+        try:
+            with open('/proc/{0}/statm'.format(pid)) as f:
+                _, rss, shared = f.read().split()[:3]
+        except OSError:
+            return None
+        page = os.sysconf('SC_PAGE_SIZE') // 1024
+        values = {'Rss': int(rss) * page, 'Shared_Clean': int(shared) * page}
+        values['Private_Clean'] = values['Rss'] - values['Shared_Clean']
+    usage = {
+        'rss': values.get('Rss', 0),
+        'pss': values.get('Pss'),
+        'shared': values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0),
+        'private': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0),
+    }
+    return dict((k, round(v / 1024, 1) if v is not None else None) for k, v in usage.items())
+
+
 def is_tty():
     '''Check wether the current process output to a tty or not'''
     return os.isatty(sys.stdout.fileno()) and not sys.platform.startswith('win')
@@ -0,0 +1,37 @@
+import pytest
+
+from ofsearch.app import create_app
+from ofsearch.benchmarks import generate_rows
+from ofsearch.database import DB, normalize
+from ofsearch.utils import ObjectDict
+
+# Enough organizations for Whoosh to skip postings blocks on quality
+ORGANIZATIONS = 2000
+
+
+@pytest.fixture(scope='session')
+def index_path(tmpdir_factory):
+    '''An index of generated organizations, shared by the whole session'''
+    path = str(tmpdir_factory.mktemp('index'))
+    db = DB(ObjectDict(index=path))
+    rows = generate_rows(ORGANIZATIONS)
+    header = next(rows)
+    with db.indexing():
+        for row in rows:
+            db.save_organization(normalize(dict(zip(header, row))))
+    return path
+
+
+@pytest.fixture
+def config(index_path):
+    return ObjectDict(index=index_path)
+
+
+@pytest.fixture
+def db(config):
+    return DB(config)
+
+
+@pytest.fixture
+def client(db):
+    return create_app(db).test_client()
@@ -0,0 +1,25 @@
+'''Conditional requests'''
+import pytest
+
+
+@pytest.mark.parametrize('path', [
+    '/organizations/?q=formation',
+    '/organizations/suggest?prefix=form',
+    '/organizations/11000000001',
+    '/organizations/export?department=69',
+    '/specialties/',
+])
+def test_not_modified(db, client, monkeypatch, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    def fail(*args, **kwargs):
+        raise AssertionError('A conditional request should be answered before doing any work')
+
+    for method in ('search', 'suggest', 'get_json', 'export'):
+        monkeypatch.setattr(db, method, fail)
+    response = client.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert not response.data
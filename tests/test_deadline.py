@@ -0,0 +1,115 @@
+'''Searches under a time limit'''
+import time
+
+import pytest
+
+from whoosh.collectors import FilterCollector, TopCollector
+from whoosh.query import Every
+
+from ofsearch.app import create_app
+from ofsearch.bitsets import Bitset
+from ofsearch.database import DB, DEADLINE_CHECK, Deadline, DeadlineCollector, DeadlineMatcher
+from ofsearch.utils import ObjectDict
+
+FILTERS = [
+    {'specialties': [330]},
+    {'department': '69'},
+    {'min_trainers': 150},
+    {'postal_code': '75', 'min_hours': 1000},
+]
+
+
+def matching(db, query, **filters):
+    '''The exact number of documents matching a query and filters'''
+    with db.searcher() as s:
+        docset = Bitset.from_docnums(s.docs_for_query(db.parse(query, s.schema)))
+    if filters:
+        docset &= db.filter(db.stores, **filters)
+    return len(docset)
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('query', ['formation', 'conseil'])
+def test_filtered_count(db, query, filters):
+    docset = db.filter(db.stores, **filters)
+    counts = []
+    with db.searcher() as s:
+        q = db.parse(query, s.schema)
+        for collector in (TopCollector(limit=10), DeadlineCollector(TopCollector(limit=10), Deadline())):
+            collector = FilterCollector(collector, allow=docset)
+            s.search_with_collector(q, collector)
+            counts.append(len(collector.results()))
+    assert counts[0] == counts[1] == matching(db, query, **filters)
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('sort', [None, 'form_total'])
+def test_filtered_total(db, filters, sort):
+    result = db.search('formation', sort=sort, **filters)
+    assert not result['partial']
+    assert result['total'] == matching(db, 'formation', **filters)
+
+
+def test_deadline_between_matches(db):
+    '''The matcher stops once the deadline is reached even if nothing is yielded'''
+    deadline = Deadline(1e-6)
+    time.sleep(0.001)
+    steps = 0
+    with db.searcher() as s:
+        matcher = DeadlineMatcher(Every().matcher(s), deadline)
+        while matcher.is_active():
+            matcher.next()
+            steps += 1
+    assert deadline.reached
+    assert steps < DEADLINE_CHECK
+
+
+def test_partial(config):
+    db = DB(ObjectDict(config, time_limit=1e-6))
+    result = db.search('', limit=5)
+    assert result['partial']
+    assert result['count'] == 'estimate'
+    assert len(result['results']) == 5
+    assert db.metrics.partial_results == 1
+
+
+@pytest.mark.parametrize('mode', ['exact', 'capped'])
+def test_count_under_deadline(db, mode):
+    '''Counting over the matches stops at the deadline'''
+    deadline = Deadline(1e-6)
+    time.sleep(0.001)
+    with db.searcher() as s:
+        q = db.parse('formation', s.schema)
+        hits = s.search(q, limit=10)
+        assert not hits.has_exact_length()
+        assert db.count(s, q, None, hits, mode) == matching(db, 'formation')
+        assert db.count(s, q, None, hits, mode, deadline) is None
+
+
+def test_partial_count(db, monkeypatch):
+    '''A total not counted in time is estimated'''
+    count = db.count
+
+    def late_count(searcher, q, docset, hits, mode='exact', deadline=None):
+        if deadline is not None:
+            deadline.reached = True
+        return count(searcher, q, docset, hits, mode, deadline)
+
+    monkeypatch.setattr(db, 'count', late_count)
+    result = db.search('formation', limit=5)
+    assert result['partial']
+    assert result['count'] == 'estimate'
+    assert result['total'] >= matching(db, 'formation')
+    assert len(result['results']) == 5
+
+
+def test_partial_not_cached(config):
+    db = DB(ObjectDict(config, time_limit=1e-6))
+    client = create_app(db).test_client()
+    for _ in range(2):
+        response = client.get('/organizations/', query_string={'limit': 5})
+        assert response.get_json()['partial']
+        assert 'ETag' not in response.headers
+        assert response.headers['Cache-Control'] == 'no-store'
+    assert len(db.pages) == 0
+    assert db.metrics.partial_results == 2
@@ -0,0 +1,133 @@
+'''Resumable and conditional downloads against a local stand-in of the dataset server'''
+import hashlib
+import os
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from ofsearch import download
+
+DATASET = b''.join(b'organization;%d\n' % i for i in range(5000))
+
+
+class Server(HTTPServer):
+    '''Serve a dataset with its validators, honoring `Range`/`If-Range` and `If-None-Match`'''
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.requests = []
+        self.disposition = None
+        self.publish(DATASET)
+
+    def publish(self, data):
+        self.data = data
+        self.etag = '"{0}"'.format(hashlib.sha1(data).hexdigest())
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/dataset.csv'.format(self.server_port)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        self.send_response(200)
+        if self.server.disposition:
+            self.send_header('Content-Disposition', self.server.disposition)
+        self.send_header('Content-Length', str(len(self.server.data)))
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers.items()))
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        if self.headers.get('Range') and self.headers.get('If-Range') == server.etag:
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                start, len(server.data) - 1, len(server.data)))
+        else:
+            self.send_response(200)
+        body = server.data[start:]
+        self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = Server()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def interrupt(server, directory, size):
+    '''Leave a partial download of the served dataset, as an interrupted download would'''
+    filename = download.local_filename(server.url, str(directory))
+    with open(filename + download.PART_SUFFIX, 'wb') as f:
+        f.write(server.data[:size])
+    download.write_state(filename + download.PART_SUFFIX + download.STATE_SUFFIX,
+                         {'url': server.url, 'etag': server.etag, 'last_modified': None})
+
+
+def test_download(server, tmpdir):
+    result = download.download(server.url, str(tmpdir))
+    assert result.status == 'downloaded'
+    assert read(result.filename) == DATASET
+    assert result.sha256 == hashlib.sha256(DATASET).hexdigest()
+    assert result.size == len(DATASET)
+    assert not os.path.exists(result.filename + download.PART_SUFFIX)
+
+
+def test_unchanged(server, tmpdir):
+    first = download.download(server.url, str(tmpdir))
+    result = download.download(server.url, str(tmpdir))
+    assert server.requests[-1]['If-None-Match'] == server.etag
+    assert result.status == 'unchanged'
+    assert result.sha256 == first.sha256
+    assert read(result.filename) == DATASET
+
+
+def test_resume(server, tmpdir):
+    interrupt(server, tmpdir, 1000)
+    result = download.download(server.url, str(tmpdir))
+    assert server.requests[-1]['Range'] == 'bytes=1000-'
+    assert server.requests[-1]['If-Range'] == server.etag
+    assert result.status == 'resumed'
+    assert read(result.filename) == DATASET
+    assert result.sha256 == hashlib.sha256(DATASET).hexdigest()
+
+
+def test_resume_changed(server, tmpdir):
+    interrupt(server, tmpdir, 1000)
+    changed = DATASET.replace(b'organization', b'organisme')
+    server.publish(changed)
+    result = download.download(server.url, str(tmpdir))
+    assert 'If-Range' in server.requests[-1]
+    assert result.status == 'downloaded'
+    assert read(result.filename) == changed
+    assert result.sha256 == hashlib.sha256(changed).hexdigest()
+
+
+def test_content_disposition(server, tmpdir):
+    server.disposition = 'attachment; filename="ListeOF_20161116.csv"'
+    result = download.download(server.url.replace('dataset.csv', 'resource'), str(tmpdir))
+    assert result.filename == str(tmpdir.join('ListeOF_20161116.csv'))
+    assert read(result.filename) == DATASET
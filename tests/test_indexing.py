@@ -0,0 +1,35 @@
+'''Full and incremental indexing'''
+from ofsearch.benchmarks import generate_docs
+from ofsearch.database import DB
+from ofsearch.utils import ObjectDict
+
+
+def load(db, docs, incremental=False):
+    with db.indexing(incremental=incremental) as infos:
+        for doc in docs:
+            db.save_organization(doc)
+    return infos
+
+
+def test_incremental_update_keeps_siren_siblings(tmpdir):
+    docs = list(generate_docs(20))
+    for doc in docs[1:3]:
+        doc['da_siren'] = docs[0]['da_siren']
+    db = DB(ObjectDict(index=str(tmpdir)))
+    load(db, docs)
+    docs[2] = dict(docs[2], form_total=(docs[2]['form_total'] or 0) + 1)
+    infos = load(db, docs, incremental=True)
+    assert infos['updated'] == 1
+    assert infos['unchanged'] == len(docs) - 1
+    with db.searcher() as s:
+        assert s.doc_count() == len(docs)
+    for doc in docs[:3]:
+        assert db.get(doc['numero_de_da'])['form_total'] == doc['form_total']
+
+
+def test_full_load_is_optimized(tmpdir):
+    db = DB(ObjectDict(index=str(tmpdir)))
+    infos = load(db, generate_docs(200))
+    assert infos['optimize']
+    with db.searcher() as s:
+        assert len(s.reader().leaf_readers()) == 1
@@ -0,0 +1,22 @@
+'''Metrics recorded by other processes'''
+from ofsearch.metrics import Metrics
+
+
+def test_merge():
+    worker, main = Metrics(), Metrics()
+    with worker.trace('search'):
+        with worker.stage('search'):
+            pass
+    worker.partial_results += 1
+    main.merge(worker.collect({'pages': {'size': 1, 'maxsize': 10, 'hits': 2, 'misses': 3, 'evictions': 0}}))
+    assert main.requests['search'].count == 1
+    assert main.stages['search'].count == 1
+    assert main.partial_results == 1
+
+    # Only the metrics recorded since the previous collect are merged again
+    main.merge(worker.collect({'pages': {'size': 1, 'maxsize': 10, 'hits': 5, 'misses': 3, 'evictions': 0}}))
+    assert main.requests['search'].count == 1
+    assert main.partial_results == 1
+    caches = main.caches({'pages': {'size': 2, 'maxsize': 10, 'hits': 1, 'misses': 1, 'evictions': 0}})
+    assert caches['pages']['hits'] == 6
+    assert caches['pages']['size'] == 3
@@ -0,0 +1,17 @@
+'''Dataset readers'''
+import pytest
+
+from ofsearch import readers
+
+
+@pytest.mark.parametrize('content,expected', [
+    ('numero_de_da;da_siren\n11;300\n12;\n', [('numero_de_da', 'da_siren'), ('11', '300'), ('12', None)]),
+    ('numero_de_da,da_siren\n11,300\n', [('numero_de_da', 'da_siren'), ('11', '300')]),
+    # The delimiter can not be detected from a single column
+    ('numero_de_da\n11\n12\n', [('numero_de_da',), ('11',), ('12',)]),
+])
+def test_read_csv(tmpdir, content, expected):
+    filename = tmpdir.join('dataset.csv')
+    filename.write(content)
+    header, rows, _ = readers.read(str(filename))
+    assert [header] + list(rows) == expected
@@ -0,0 +1,62 @@
+'''Pre-serialized responses should stay identical to the `marshal_with` ones'''
+import json
+
+import pytest
+
+from flask_restplus import marshal
+
+from ofsearch.api import organization, search_results
+from ofsearch.app import create_app
+from ofsearch.database import DB
+from ofsearch.utils import ObjectDict
+
+
+def marshalled(data, model):
+    '''The API output of `data` as marshalled by flask_restplus'''
+    return json.loads(json.dumps(marshal(data, model)))
+
+
+def test_display(db, client):
+    with db.searcher() as s:
+        docs = [s.stored_fields(docnum) for docnum in range(0, s.doc_count_all(), 97)]
+    for doc in docs:
+        response = client.get('/organizations/{0}'.format(doc['numero_de_da']))
+        assert response.status_code == 200
+        assert response.get_json() == marshalled(db.doc_to_org(doc), organization)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'q': 'formation', 'limit': 20},
+    {'q': 'conseil', 'limit': 5, 'page': 3},
+    {'q': 'formation', 'limit': 20, 'specialty': 330, 'facets': 'specialty'},
+    {'q': '', 'limit': 5, 'sort': 'form_total'},
+    {'q': 'formation', 'limit': 20, 'count': 'estimate', 'department': '69'},
+])
+def test_search(db, client, kwargs):
+    response = client.get('/organizations/', query_string=kwargs)
+    assert response.status_code == 200
+    args = dict(kwargs)
+    query = args.pop('q')
+    if 'specialty' in args:
+        args['specialties'] = [args.pop('specialty')]
+    if 'facets' in args:
+        args['facets'] = [args['facets']]
+    assert response.get_json() == marshalled(db.search(query, **args), search_results)
+
+
+def test_search_with_cursor(db, client):
+    first = client.get('/organizations/', query_string={'q': 'formation', 'limit': 5}).get_json()
+    assert first['next_cursor']
+    response = client.get('/organizations/', query_string={'q': 'formation', 'limit': 5,
+                                                           'cursor': first['next_cursor']})
+    expected = db.search('formation', limit=5, cursor=first['next_cursor'])
+    assert expected['next_cursor']
+    assert response.get_json() == marshalled(expected, search_results)
+
+
+def test_partial_search(config):
+    db = DB(ObjectDict(config, time_limit=1e-6, cache_size=0))
+    response = create_app(db).test_client().get('/organizations/', query_string={'limit': 5})
+    expected = db.search('', limit=5)
+    assert expected['partial']
+    assert response.get_json() == marshalled(expected, search_results)